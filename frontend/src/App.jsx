@@ -1,5 +1,6 @@
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 import axios from 'axios';
+import { DEFAULT_UPLOAD_CONFIG, formatBytes, preprocessImage } from './imagePreprocess';
 import './App.css';
 
 function App() {
@@ -10,6 +11,17 @@ function App() {
   const [loading, setLoading] = useState(false);
   const [progress, setProgress] = useState('');
   const [logs, setLogs] = useState([]);
+  const [uploadConfig, setUploadConfig] = useState(DEFAULT_UPLOAD_CONFIG);
+
+  useEffect(() => {
+    // 获取服务端的图片尺寸上限，获取失败时使用默认值
+    axios.get('/api/config')
+      .then(response => setUploadConfig({ ...DEFAULT_UPLOAD_CONFIG, ...response.data }))
+      .catch(error => {
+        console.warn('获取服务端配置失败，使用默认上传参数:', error);
+        addLog(`获取服务端配置失败，按默认最长边 ${DEFAULT_UPLOAD_CONFIG.max_image_dimension}px 预处理: ${error.message}`);
+      });
+  }, []);
 
   const addLog = (message) => {
     setLogs(prev => [...prev, { id: Date.now(), message }]);
@@ -41,9 +53,17 @@ function App() {
     addLog('开始处理图像...');
     
     try {
+      // 上传前在浏览器内缩放到服务端的最长边上限并重新编码
+      const [characterUpload, referenceUpload] = await Promise.all([
+        preprocessImage(characterImage, uploadConfig),
+        preprocessImage(referenceImage, uploadConfig),
+      ]);
+      addLog(`图像预处理完成：角色图 ${formatBytes(characterImage.size)} → ${formatBytes(characterUpload.size)}，`
+        + `参考图 ${formatBytes(referenceImage.size)} → ${formatBytes(referenceUpload.size)}`);
+
       const formData = new FormData();
-      formData.append('character_image', characterImage);
-      formData.append('reference_image', referenceImage);
+      formData.append('character_image', characterUpload);
+      formData.append('reference_image', referenceUpload);
       if (prompt) {
         formData.append('prompt', prompt);
       }
@@ -0,0 +1,97 @@
+// 上传前的图片预处理：在浏览器内解码、按服务端下发的最长边缩放并重新编码，
+// 避免上传后端反正会丢弃的像素
+
+export const DEFAULT_UPLOAD_CONFIG = {
+  max_image_dimension: 1024,
+  upload_format: 'image/jpeg',
+  upload_quality: 0.9,
+};
+
+const EXTENSIONS = {
+  'image/jpeg': '.jpg',
+  'image/png': '.png',
+  'image/webp': '.webp',
+};
+
+const decodeImage = async (file) => {
+  if (typeof createImageBitmap === 'function') {
+    try {
+      // 按EXIF方向解码，避免手机照片上传后被旋转
+      return await createImageBitmap(file, { imageOrientation: 'from-image' });
+    } catch (error) {
+      // 部分浏览器不支持选项参数，退回 <img> 解码
+    }
+  }
+
+  const url = URL.createObjectURL(file);
+  try {
+    const img = new Image();
+    img.src = url;
+    await img.decode();
+    return img;
+  } finally {
+    URL.revokeObjectURL(url);
+  }
+};
+
+const canvasToBlob = (canvas, type, quality) => new Promise((resolve) => {
+  canvas.toBlob(resolve, type, quality);
+});
+
+const renameWithExtension = (name, type) => {
+  const ext = EXTENSIONS[type] || '';
+  const base = name.replace(/\.[^.]+$/, '') || 'upload';
+  return base + ext;
+};
+
+export const preprocessImage = async (file, config = DEFAULT_UPLOAD_CONFIG) => {
+  const maxDimension = config.max_image_dimension || DEFAULT_UPLOAD_CONFIG.max_image_dimension;
+  const type = config.upload_format || DEFAULT_UPLOAD_CONFIG.upload_format;
+  const quality = config.upload_quality || DEFAULT_UPLOAD_CONFIG.upload_quality;
+
+  let source;
+  try {
+    source = await decodeImage(file);
+  } catch (error) {
+    // 浏览器无法解码的格式原样上传，由后端处理
+    return file;
+  }
+
+  const width = source.width;
+  const height = source.height;
+  const scale = Math.min(1, maxDimension / Math.max(width, height));
+  const targetWidth = Math.max(1, Math.round(width * scale));
+  const targetHeight = Math.max(1, Math.round(height * scale));
+
+  const canvas = document.createElement('canvas');
+  canvas.width = targetWidth;
+  canvas.height = targetHeight;
+  const ctx = canvas.getContext('2d');
+  if (type === 'image/jpeg') {
+    // JPEG 不支持透明通道，透明区域填白，与后端的白底处理一致
+    ctx.fillStyle = '#ffffff';
+    ctx.fillRect(0, 0, targetWidth, targetHeight);
+  }
+  ctx.imageSmoothingQuality = 'high';
+  ctx.drawImage(source, 0, 0, targetWidth, targetHeight);
+  if (typeof source.close === 'function') {
+    source.close();
+  }
+
+  const blob = await canvasToBlob(canvas, type, quality);
+  // 未缩放且重新编码后反而更大时，保留原文件
+  if (!blob || (scale === 1 && blob.size >= file.size)) {
+    return file;
+  }
+
+  return new File([blob], renameWithExtension(file.name, type), {
+    type,
+    lastModified: Date.now(),
+  });
+};
+
+export const formatBytes = (bytes) => {
+  if (bytes < 1024) return `${bytes}B`;
+  if (bytes < 1024 * 1024) return `${(bytes / 1024).toFixed(1)}KB`;
+  return `${(bytes / 1024 / 1024).toFixed(2)}MB`;
+};
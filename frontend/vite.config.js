@@ -9,6 +9,8 @@ export default defineConfig({
       '/api': {
         target: 'http://localhost:8000',
         changeOrigin: true,
+        // 后端路由没有 /api 前缀（/config、/process），转发时去掉
+        rewrite: (path) => path.replace(/^\/api/, ''),
       },
     },
   },
@@ -1,28 +1,127 @@
-from fastapi import FastAPI, UploadFile, File, Form
+import time
+# 记录应用开始导入的时间，用于统计冷启动耗时
+_BOOT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, UploadFile, File, Form, Request, HTTPException
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 import os
 from dotenv import load_dotenv
-import tempfile
 import shutil
 from typing import Dict, Any, Optional
 import asyncio
+import hashlib
+import hmac
+import uuid
+import sys
+import importlib.util
+import threading
+import requests
 
 from utils.vlm_client import VLMClient
 from utils.image_processor import ImageProcessor
 from utils.image_generator import ImageGenerator
 from utils.validation import ValidationEngine, RetryMechanism, ValidationResult
+from utils.character_profile import CharacterProfiler, format_character_features, file_content_hash
+from utils.single_flight import SingleFlight
+from utils.admission import AdmissionController, AdmissionRejected
+from utils.workspace import get_workspace_manager
+from utils.encoding import get_image_encoder
+from utils.model_cascade import get_cascade_stats
+from utils.deadline import (
+    Deadline, JobDeadline, DeadlineExceeded, activate_deadline, reset_deadline, current_deadline, check_deadline,
+    wait_within_deadline
+)
+from utils.profiling import RequestTrace, SlowRequestLog, start_trace, end_trace, run_profiled
+from utils import warmup
 
 # 加载环境变量
 load_dotenv()
 
+warmup.mark_boot_started(_BOOT_STARTED)
+warmup.mark_imports_done()
+
 app = FastAPI(
     title="角色与场景融合优化 Agent",
     description="通过前置处理解决角色与构图参考图不匹配的问题",
     version="1.0.0"
 )
 
+@app.on_event("startup")
+async def warm_up_on_startup():
+    """
+    启动预热；预加载模式下master进程在fork前已完成预热，worker无需重复
+    """
+    if not warmup.is_ready():
+        await asyncio.to_thread(warmup.warm_up)
+    # 清理线程按worker启动，预加载模式下不能在fork前创建
+    get_workspace_manager().start_sweeper()
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    get_workspace_manager().stop_sweeper()
+
+@app.get("/")
+async def root():
+    return {"message": "角色与场景融合优化 Agent API"}
+
+@app.get("/ready")
+async def readiness():
+    """
+    就绪检查：预热完成前返回503，负载均衡据此决定是否转发流量
+    """
+    readiness_state = warmup.get_readiness()
+    if not readiness_state["ready"]:
+        return JSONResponse(status_code=503, content={"status": "warming_up", **readiness_state})
+    return {"status": "ready", **readiness_state}
+
+# 准入控制（每个worker进程独立计数）
+admission_controller = AdmissionController.from_env()
+# 优先级最高的 API Key 列表
+PRIORITY_API_KEYS = {k.strip() for k in os.getenv("PRIORITY_API_KEYS", "").split(",") if k.strip()}
+
+def resolve_client(request: Request):
+    """
+    确定请求所属的客户端与优先级：按 X-API-Key 计配额，未带 Key 的按来源IP计且优先级最低
+    """
+    api_key = request.headers.get("X-API-Key")
+    if api_key:
+        return f"key:{api_key}", ("high" if api_key in PRIORITY_API_KEYS else "normal")
+    client_host = request.client.host if request.client else "unknown"
+    return f"ip:{client_host}", "low"
+
+class AdmissionMiddleware:
+    """
+    /process 的准入控制放在ASGI层，在读取请求体之前完成：
+    被拒绝的请求不会再上传、解析和落盘整个multipart请求体
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] != "/process":
+            await self.app(scope, receive, send)
+            return
+
+        request = Request(scope)
+        # 时间预算从请求到达时开始计算，排队等待与上传也计入
+        scope["deadline"] = Deadline.from_request(request.headers.get("X-Request-Timeout"))
+        client_key, priority = resolve_client(request)
+        try:
+            async with admission_controller.admit(client_key, priority):
+                await self.app(scope, receive, send)
+        except AdmissionRejected as e:
+            response = JSONResponse(
+                status_code=e.status_code,
+                content={"status": "error", "message": e.reason},
+                headers={"Retry-After": str(e.retry_after)},
+            )
+            await response(scope, receive, send)
+
+# 后添加的中间件在外层：CORS包在准入控制外面，被拒绝的响应也带CORS头
+app.add_middleware(AdmissionMiddleware)
 # 添加CORS中间件
 app.add_middleware(
     CORSMiddleware,
@@ -32,82 +131,159 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.get("/")
-async def root():
-    return {"message": "角色与场景融合优化 Agent API"}
+# 最慢请求记录，按阶段给出耗时明细
+slow_request_log = SlowRequestLog(capacity=int(os.getenv("SLOW_REQUEST_LOG_SIZE", 20)))
 
-@app.post("/process")
-async def process_images(
-    character_image: UploadFile = File(...),
-    reference_image: UploadFile = File(...),
-    prompt: str = Form(None)
-):
+def is_admin(request: Request) -> bool:
     """
-    处理角色图和参考图，生成融合图像
+    校验管理员令牌（X-Admin-Token 与 ADMIN_TOKEN 一致）；未配置 ADMIN_TOKEN 时管理功能关闭
+    """
+    admin_token = os.getenv("ADMIN_TOKEN")
+    provided = request.headers.get("X-Admin-Token")
+    if not admin_token or not provided:
+        return False
+    return hmac.compare_digest(admin_token.encode(), provided.encode())
+
+def profiling_requested(request: Request) -> bool:
+    """管理员通过 X-Profile: 1 请求头或 ?profile=1 查询参数对单个请求开启性能分析"""
+    flag = request.headers.get("X-Profile") or request.query_params.get("profile")
+    return flag in ("1", "true") and is_admin(request)
+
+# 在途任务合并表，键为输入内容与参数的哈希
+job_flight = SingleFlight()
+# 合并执行的任务共享的截止时间，只在事件循环线程中读写
+job_deadlines: Dict[str, JobDeadline] = {}
+
+async def watch_disconnect(request: Request, deadline: Deadline) -> None:
     """
-    # 创建临时目录存储上传的文件
-    temp_dir = tempfile.mkdtemp()
+    定期检查客户端是否已断开，断开后设置取消标记，流水线在下一个阶段之前停止
+    """
+    interval = float(os.getenv("DISCONNECT_POLL_INTERVAL", 1.0))
+    while not deadline.cancelled:
+        if await request.is_disconnected():
+            deadline.cancel("client_disconnected")
+            return
+        await asyncio.sleep(interval)
+
+def compute_job_key(character_path: str, reference_path: str, prompt: Optional[str]) -> str:
+    """
+    按图片内容与生成参数计算任务键
+    """
+    digest = hashlib.sha256()
+    digest.update(file_content_hash(character_path).encode())
+    digest.update(file_content_hash(reference_path).encode())
+    digest.update((prompt or "").encode("utf-8"))
+    return digest.hexdigest()
+
+# 单轮“生成+校验”耗时的指数滑动平均，用于判断剩余时间是否还够再跑一轮
+_round_seconds_ema: Optional[float] = None
+_round_seconds_lock = threading.Lock()
+
+def estimate_round_seconds() -> Optional[float]:
+    return _round_seconds_ema
+
+def record_round_seconds(seconds: float) -> None:
+    global _round_seconds_ema
+    with _round_seconds_lock:
+        if _round_seconds_ema is None:
+            _round_seconds_ema = seconds
+        else:
+            _round_seconds_ema = 0.8 * _round_seconds_ema + 0.2 * seconds
+
+def is_deadline_error(error: Exception, deadline: Optional[Deadline]) -> bool:
+    """时间预算用完导致的失败（含上游调用因剩余时间耗尽而超时）"""
+    if isinstance(error, DeadlineExceeded):
+        return True
+    return isinstance(error, requests.exceptions.Timeout) and deadline is not None and deadline.expired()
+
+def run_pipeline(character_path: str, reference_path: str, prompt: Optional[str]) -> Dict[str, Any]:
+    """
+    执行 Think-Action-Generate-Observation 完整流程（阻塞调用，在线程池中运行）
+    """
+    # 当前请求的截止时间（直接调用流水线时没有）
+    deadline = current_deadline()
     
-    try:
-        # 保存上传的图片
-        character_path = os.path.join(temp_dir, character_image.filename)
-        reference_path = os.path.join(temp_dir, reference_image.filename)
-        
-        with open(character_path, "wb") as f:
-            shutil.copyfileobj(character_image.file, f)
-        
-        with open(reference_path, "wb") as f:
-            shutil.copyfileobj(reference_image.file, f)
-        
-        # 初始化各组件
-        vlm_client = VLMClient()
-        image_processor = ImageProcessor()
-        image_generator = ImageGenerator()
-        validation_engine = ValidationEngine()
-        retry_mechanism = RetryMechanism()
-        
-        # 步骤1: Think - 分析参考图并提取结构化约束
-        analysis_result = vlm_client.analyze_composition(reference_path)
-        
-        # 步骤2: Action - 图像预处理
-        # 调整角色图以适应参考图的景别要求
-        adjusted_character_path = image_processor.adjust_character_proportions(
-            character_path, analysis_result
-        )
-        
-        # 应用透视变换
-        perspective_adjusted_path = image_processor.apply_perspective_transform(
-            adjusted_character_path, analysis_result
-        )
-        
-        # 创建适配后的参考图（对原人物进行遮罩处理）
-        adapted_reference_path = image_processor.create_adapted_reference(
-            reference_path, analysis_result
-        )
-        
-        # 步骤3: 生成带权重的结构化Prompt
-        if not prompt:
-            prompt = "A detailed scene composition with character integration"
-        
-        structured_prompt = image_generator.construct_structured_prompt(
-            scene_description=prompt,
-            character_features="Character features from uploaded image",
-            original_scene_weight=0.3,
-            target_character_weight=0.7
-        )
-        
-        # 步骤4: 生成图像
-        params = {
-            "scale_factor": 1.0,
-            "target_character_weight": 0.7,
-            "original_scene_weight": 0.3,
-            "perspective_adjustment": 0.0
-        }
-        
-        retry_count = 0
-        generated_image_path = None
+    # 初始化各组件
+    vlm_client = VLMClient()
+    image_processor = ImageProcessor()
+    image_generator = ImageGenerator()
+    validation_engine = ValidationEngine()
+    retry_mechanism = RetryMechanism()
+    character_profiler = CharacterProfiler()
+    
+    # 步骤1: Think - 分析参考图并提取结构化约束
+    check_deadline("构图分析")
+    analysis_result = vlm_client.analyze_composition(reference_path)
+    
+    # 步骤2: Action - 图像预处理
+    check_deadline("图像预处理")
+    # 定位角色主体并紧凑裁切，去掉无关背景
+    subject_character_path = image_processor.crop_to_subject(character_path)
+    
+    # 调整角色图以适应参考图的景别要求
+    adjusted_character_path = image_processor.adjust_character_proportions(
+        subject_character_path, analysis_result
+    )
+    
+    # 应用透视变换
+    perspective_adjusted_path = image_processor.apply_perspective_transform(
+        adjusted_character_path, analysis_result
+    )
+    
+    # 创建适配后的参考图（对原人物进行遮罩处理）
+    adapted_reference_path = image_processor.create_adapted_reference(
+        reference_path, analysis_result
+    )
+    
+    # 待发送给生图API的两张图提前在后台线程编码，与下面的角色档案VLM调用重叠
+    image_generator.prefetch_payload(adapted_reference_path, "payload.reference")
+    image_generator.prefetch_payload(perspective_adjusted_path, "payload.character")
+    
+    # 提取角色档案（按图片内容哈希持久缓存，同一角色只描述一次）
+    check_deadline("角色档案")
+    character_profile = character_profiler.get_profile(character_path, vlm_client)
+    character_features = format_character_features(character_profile)
+    
+    # 步骤3: 生成带权重的结构化Prompt
+    if not prompt:
+        prompt = "A detailed scene composition with character integration"
+    
+    structured_prompt = image_generator.construct_structured_prompt(
+        scene_description=prompt,
+        character_features=character_features,
+        original_scene_weight=0.3,
+        target_character_weight=0.7
+    )
+    
+    # 步骤4: 生成图像
+    params = {
+        "scale_factor": 1.0,
+        "target_character_weight": 0.7,
+        "original_scene_weight": 0.3,
+        "perspective_adjustment": 0.0
+    }
+    
+    retry_count = 0
+    generated_image_path = None
+    validation_results = None
+    # 目前得分最高的一轮：(平均得分, 生成图路径, 校验结果, 重试次数)
+    best_round = None
+    last_round_seconds = None
+    deadline_exceeded = False
+    
+    while True:
+        # 剩余时间不足以完成一轮生成时不再开始新的一轮，返回目前最好的结果
+        round_estimate = last_round_seconds or estimate_round_seconds() or 0.0
+        if deadline is not None and not deadline.allows(round_estimate):
+            # 客户端已断开或还没有任何完成的轮次时报错，否则返回已有的最好结果
+            if deadline.cancelled or best_round is None:
+                check_deadline("生成图像")
+                raise DeadlineExceeded(f"剩余时间不足以完成一轮生成（预计 {round_estimate:.1f} 秒）")
+            deadline_exceeded = True
+            break
         
-        while True:
+        round_started = time.perf_counter()
+        try:
             # 生成图像
             generated_image_path = image_generator.generate_image(
                 prompt=structured_prompt,
@@ -116,67 +292,274 @@ async def process_images(
                 width=1024,
                 height=1024
             )
-            
+        
             # 验证生成结果
             validation_results = validation_engine.comprehensive_validation(
                 generated_image_path, analysis_result, character_path
             )
-            
-            # 检查是否需要重试
-            if not retry_mechanism.should_retry(validation_results, retry_count):
-                break
-            
-            # 调整参数进行重试
-            params = retry_mechanism.adjust_parameters_for_retry(
-                params, validation_results, retry_count
-            )
-            
-            # 更新prompt权重
-            structured_prompt = image_generator.construct_structured_prompt(
-                scene_description=prompt,
-                character_features="Character features from uploaded image",
-                original_scene_weight=params["original_scene_weight"],
-                target_character_weight=params["target_character_weight"]
-            )
-            
-            retry_count += 1
-            
-            if retry_count >= retry_mechanism.max_retries:
-                break
+        except Exception as e:
+            if best_round is None or not is_deadline_error(e, deadline):
+                raise
+            deadline_exceeded = True
+            break
         
-        # 返回结果
-        result = {
-            "status": "success",
-            "message": "图像处理完成",
-            "analysis_result": analysis_result,
-            "validation_results": {
-                k: {"success": v.success, "score": v.score, "feedback": v.feedback}
-                for k, v in validation_results.items()
-            },
-            "generated_image_path": generated_image_path,
-            "retry_count": retry_count,
-            "intermediate_files": {
-                "adjusted_character_path": adjusted_character_path,
-                "perspective_adjusted_path": perspective_adjusted_path,
-                "adapted_reference_path": adapted_reference_path
-            }
+        last_round_seconds = time.perf_counter() - round_started
+        record_round_seconds(last_round_seconds)
+        
+        round_score = sum(v.score for v in validation_results.values()) / max(len(validation_results), 1)
+        if best_round is None or round_score > best_round[0]:
+            best_round = (round_score, generated_image_path, validation_results, retry_count)
+    
+        # 检查是否需要重试
+        if not retry_mechanism.should_retry(validation_results, retry_count):
+            break
+    
+        # 调整参数进行重试
+        params = retry_mechanism.adjust_parameters_for_retry(
+            params, validation_results, retry_count
+        )
+    
+        # 更新prompt权重
+        structured_prompt = image_generator.construct_structured_prompt(
+            scene_description=prompt,
+            character_features=character_features,
+            original_scene_weight=params["original_scene_weight"],
+            target_character_weight=params["target_character_weight"]
+        )
+    
+        retry_count += 1
+    
+        if retry_count >= retry_mechanism.max_retries:
+            break
+    
+    if deadline_exceeded:
+        # 时间预算用完，返回已完成轮次中得分最高的结果
+        _, generated_image_path, validation_results, retry_count = best_round
+    
+    # 返回结果
+    result = {
+        "status": "success",
+        "message": "时间预算已用完，返回目前得分最高的结果" if deadline_exceeded else "图像处理完成",
+        "analysis_result": analysis_result,
+        "character_features": character_features,
+        "validation_results": {
+            k: {"success": v.success, "score": v.score, "feedback": v.feedback}
+            for k, v in validation_results.items()
+        },
+        "generated_image_path": generated_image_path,
+        "retry_count": retry_count,
+        "deadline_exceeded": deadline_exceeded,
+        "intermediate_files": {
+            "subject_character_path": subject_character_path,
+            "adjusted_character_path": adjusted_character_path,
+            "perspective_adjusted_path": perspective_adjusted_path,
+            "adapted_reference_path": adapted_reference_path
         }
+    }
+    
+    return result
+
+@app.get("/config")
+async def client_config():
+    """
+    前端上传前预处理所需的参数：最长边与重新编码格式，保证前后端的缩放上限一致
+    """
+    return {
+        "max_image_dimension": int(os.getenv("MAX_IMAGE_DIMENSION", 1024)),
+        "upload_format": os.getenv("UPLOAD_FORMAT", "image/jpeg"),
+        "upload_quality": float(os.getenv("UPLOAD_QUALITY", 0.9)),
+    }
+
+@app.get("/metrics/admission")
+async def admission_metrics():
+    """
+    准入控制指标：并发、队列深度、拒绝次数与等待时间
+    """
+    return admission_controller.metrics()
+
+@app.get("/metrics/workspace")
+async def workspace_metrics():
+    """
+    工作区占用与后台清理统计
+    """
+    return get_workspace_manager().stats()
+
+@app.get("/metrics/encoding")
+async def encoding_metrics():
+    """
+    各阶段编码的输入/输出字节数与节省的字节数
+    """
+    return get_image_encoder().stats()
+
+@app.get("/metrics/vlm-cascade")
+async def vlm_cascade_metrics():
+    """
+    VLM模型级联各层级的调用次数、命中率、升级原因与耗时
+    """
+    return get_cascade_stats().snapshot()
+
+@app.get("/admin/slow-requests")
+async def slow_requests(request: Request):
+    """
+    最慢的N个请求及其在 VLMClient / ImageProcessor / ImageGenerator / ValidationEngine 各阶段的耗时
+    """
+    if not is_admin(request):
+        raise HTTPException(status_code=403, detail="需要管理员权限")
+    return {"requests": slow_request_log.slowest()}
+
+@app.post("/process")
+async def process_images(
+    request: Request,
+    character_image: UploadFile = File(...),
+    reference_image: UploadFile = File(...),
+    prompt: str = Form(None)
+):
+    """
+    处理角色图和参考图，生成融合图像
+    """
+    # 准入控制与时间预算由 AdmissionMiddleware 在读取请求体之前完成
+    deadline = request.scope.get("deadline") or Deadline.from_request(request.headers.get("X-Request-Timeout"))
+    return await _process_admitted(request, character_image, reference_image, prompt, deadline)
+
+async def _process_admitted(request: Request, character_image: UploadFile, reference_image: UploadFile,
+                            prompt: Optional[str], deadline: Deadline) -> Dict[str, Any]:
+    """
+    已准入请求的处理流程
+    """
+    job_id = uuid.uuid4().hex[:12]
+    # 阶段耗时经 contextvars 传入线程池中的流水线
+    trace = RequestTrace(job_id)
+    trace_token = start_trace(trace)
+    
+    # 为任务分配带配额的工作区，流水线写出的文件都会登记到这里
+    workspace = get_workspace_manager().create(job_id)
+    workspace.activate()
+    
+    # 客户端断开时取消任务；流水线线程仍会被等待结束，工作区在其不再写文件后才释放
+    disconnect_watcher = asyncio.create_task(watch_disconnect(request, deadline))
+    
+    try:
+        # 保存上传的图片（加前缀避免两张图同名时互相覆盖）
+        character_path = workspace.file_path(f"character_{os.path.basename(character_image.filename or '')}")
+        reference_path = workspace.file_path(f"reference_{os.path.basename(reference_image.filename or '')}")
+        
+        with open(character_path, "wb") as f:
+            shutil.copyfileobj(character_image.file, f)
+        workspace.track(character_path)
+        
+        with open(reference_path, "wb") as f:
+            shutil.copyfileobj(reference_image.file, f)
+        workspace.track(reference_path)
+        
+        if profiling_requested(request):
+            # 性能分析请求单独执行，不与其他请求合并
+            deadline_token = activate_deadline(deadline)
+            try:
+                result, trace.profile_path = await asyncio.to_thread(
+                    run_profiled, job_id, run_pipeline, character_path, reference_path, prompt
+                )
+            finally:
+                reset_deadline(deadline_token)
+        else:
+            # 相同输入（图片内容+提示词）的并发请求合并为一次执行，共享结果；
+            # 合并后的任务按最晚的截止时间执行，所有等待的客户端都断开才取消
+            job_key = compute_job_key(character_path, reference_path, prompt)
+            job_deadline = job_deadlines.setdefault(job_key, JobDeadline())
+            job_deadline.join(deadline)
+            deadline_token = activate_deadline(job_deadline)
+            try:
+                shared, leader = job_flight.start_async(job_key, run_pipeline, character_path, reference_path, prompt)
+                if leader:
+                    # 流水线读写的是发起者工作区里的文件，发起者必须等到流水线结束才能释放工作区
+                    result = await asyncio.shield(shared)
+                else:
+                    # 加入已在执行的任务的请求只按自己的时间预算等待
+                    result = await wait_within_deadline(shared, deadline)
+            finally:
+                reset_deadline(deadline_token)
+                if job_deadline.leave(deadline) and job_deadlines.get(job_key) is job_deadline:
+                    job_deadlines.pop(job_key)
         
+        result = dict(result)
+        result["job_id"] = job_id
+        if trace.profile_path:
+            result["profile_path"] = trace.profile_path
         return result
         
     except Exception as e:
-        return {"status": "error", "message": str(e)}
+        return {
+            "status": "error",
+            "message": str(e),
+            "job_id": job_id,
+            "deadline_exceeded": is_deadline_error(e, deadline),
+        }
     finally:
-        # 清理临时文件
-        try:
-            shutil.rmtree(temp_dir)
-        except:
-            pass  # 忽略清理错误
+        disconnect_watcher.cancel()
+        end_trace(trace_token)
+        trace.finish()
+        slow_request_log.record(trace)
+        # 清理任务工作区
+        workspace.release()
+
+def _optional_backend(module_name: str) -> str:
+    """uvloop/httptools 为可选依赖，已安装则启用，否则回退到标准实现"""
+    return module_name if importlib.util.find_spec(module_name) else "auto"
+
+def run_production_server():
+    """
+    生产模式：多worker进程，应用在master中预加载并完成预热后再fork
+    """
+    host = os.getenv("HOST", "0.0.0.0")
+    port = int(os.getenv("PORT", 8000))
+    workers = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+
+    # fork前完成所有重量级导入与预热，worker通过写时复制共享
+    warmup.warm_up()
+
+    if importlib.util.find_spec("gunicorn") is None:
+        # 没有gunicorn时退回uvicorn多进程（spawn方式，无法共享预加载结果）
+        uvicorn.run(
+            "main:app",
+            host=host,
+            port=port,
+            workers=workers,
+            loop=_optional_backend("uvloop"),
+            http=_optional_backend("httptools"),
+        )
+        return
+
+    from gunicorn.app.base import BaseApplication
+
+    class PreloadedApplication(BaseApplication):
+        def __init__(self, application, options: Dict[str, Any]):
+            self.application = application
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+    PreloadedApplication(app, {
+        "bind": f"{host}:{port}",
+        "workers": workers,
+        # UvicornWorker 会自动选用已安装的 uvloop/httptools
+        "worker_class": "uvicorn.workers.UvicornWorker",
+        "preload_app": True,
+        "timeout": int(os.getenv("WORKER_TIMEOUT", 300)),
+        "graceful_timeout": 30,
+    }).run()
 
 if __name__ == "__main__":
-    uvicorn.run(
-        "main:app",
-        host=os.getenv("HOST", "0.0.0.0"),
-        port=int(os.getenv("PORT", 8000)),
-        reload=True
-    )
\ No newline at end of file
+    if "--production" in sys.argv or os.getenv("SERVER_MODE") == "production":
+        run_production_server()
+    else:
+        uvicorn.run(
+            "main:app",
+            host=os.getenv("HOST", "0.0.0.0"),
+            port=int(os.getenv("PORT", 8000)),
+            reload=True
+        )
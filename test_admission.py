@@ -0,0 +1,175 @@
+"""
+准入控制的单元测试
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import main
+from utils.admission import AdmissionController, AdmissionRejected
+
+def run(coro):
+    return asyncio.run(coro)
+
+def test_admits_immediately_when_idle():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=2)
+        async with controller.admit("key:a"):
+            assert controller.metrics()["active"] == 1
+        return controller.metrics()
+
+    metrics = run(scenario())
+    assert metrics["active"] == 0
+    assert metrics["admitted"] == 1
+
+def test_per_key_concurrency_queues_then_admits():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=4, per_key_concurrent=1, max_wait=5)
+        order = []
+        first_entered = asyncio.Event()
+        release_first = asyncio.Event()
+
+        async def first():
+            async with controller.admit("key:a"):
+                order.append("first")
+                first_entered.set()
+                await release_first.wait()
+
+        async def second():
+            await first_entered.wait()
+            async with controller.admit("key:a"):
+                order.append("second")
+
+        tasks = [asyncio.create_task(first()), asyncio.create_task(second())]
+        await first_entered.wait()
+        await asyncio.sleep(0.01)
+        assert controller.metrics()["queue_depth"] == 1
+        release_first.set()
+        await asyncio.gather(*tasks)
+        return order, controller.metrics()
+
+    order, metrics = run(scenario())
+    assert order == ["first", "second"]
+    assert metrics["queue_depth"] == 0
+    assert metrics["active"] == 0
+
+def test_rejects_client_over_queue_quota_with_429():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, per_key_concurrent=1, per_key_queue=1, max_wait=5)
+        hold = asyncio.Event()
+
+        async def holder():
+            async with controller.admit("key:a"):
+                await hold.wait()
+
+        async def waiter():
+            async with controller.admit("key:a"):
+                pass
+
+        tasks = [asyncio.create_task(holder())]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(waiter()))
+        await asyncio.sleep(0.01)
+        with pytest.raises(AdmissionRejected) as excinfo:
+            async with controller.admit("key:a"):
+                pass
+        hold.set()
+        await asyncio.gather(*tasks)
+        return excinfo.value, controller.metrics()
+
+    rejected, metrics = run(scenario())
+    assert rejected.status_code == 429
+    assert rejected.retry_after >= 1
+    assert metrics["rejected_client_quota"] == 1
+
+def test_rejects_with_503_when_queue_full_or_wait_times_out():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, per_key_concurrent=1, max_queue=1, max_wait=0.05)
+        hold = asyncio.Event()
+
+        async def holder():
+            async with controller.admit("key:a"):
+                await hold.wait()
+
+        holder_task = asyncio.create_task(holder())
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(controller.admit("key:b").__aenter__())
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as queue_full:
+            async with controller.admit("key:c"):
+                pass
+        with pytest.raises(AdmissionRejected) as timed_out:
+            await queued
+        hold.set()
+        await holder_task
+        return queue_full.value, timed_out.value, controller.metrics()
+
+    queue_full, timed_out, metrics = run(scenario())
+    assert queue_full.status_code == 503
+    assert timed_out.status_code == 503
+    assert metrics["rejected_queue_full"] == 1
+    assert metrics["rejected_wait_timeout"] == 1
+    assert metrics["queue_depth"] == 0
+    assert metrics["active"] == 0
+
+def test_higher_priority_is_dispatched_first():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, per_key_concurrent=1, max_wait=5)
+        order = []
+        hold = asyncio.Event()
+
+        async def holder():
+            async with controller.admit("key:holder"):
+                await hold.wait()
+
+        async def request(key, priority):
+            async with controller.admit(key, priority):
+                order.append(priority)
+
+        holder_task = asyncio.create_task(holder())
+        await asyncio.sleep(0)
+        tasks = [
+            asyncio.create_task(request("key:low", "low")),
+            asyncio.create_task(request("key:normal", "normal")),
+            asyncio.create_task(request("key:high", "high")),
+        ]
+        await asyncio.sleep(0.01)
+        hold.set()
+        await asyncio.gather(holder_task, *tasks)
+        return order
+
+    assert run(scenario()) == ["high", "normal", "low"]
+
+def test_rejected_upload_body_is_never_read(monkeypatch):
+    """被拒绝的 /process 请求在读取请求体之前就返回，不会上传和解析整个请求体"""
+    monkeypatch.setattr(main, "admission_controller", AdmissionController(max_concurrent=0, max_queue=0))
+    body_reads = []
+    messages = []
+
+    async def app(scope, receive, send):
+        raise AssertionError("被拒绝的请求不应进入应用")
+
+    async def receive():
+        body_reads.append(True)
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/process",
+        "headers": [(b"x-api-key", b"client")],
+        "query_string": b"",
+        "client": ("127.0.0.1", 1234),
+    }
+    run(main.AdmissionMiddleware(app)(scope, receive, send))
+
+    assert body_reads == []
+    assert messages[0]["status"] == 503
+    assert any(name.lower() == b"retry-after" for name, _ in messages[0]["headers"])
@@ -0,0 +1,243 @@
+"""
+截止时间与取消逻辑的单元测试
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import main
+from utils.deadline import (
+    Deadline, JobDeadline, DeadlineExceeded, RequestCancelled, activate_deadline, reset_deadline,
+    check_deadline, upstream_timeout, wait_within_deadline
+)
+from utils.single_flight import SingleFlight
+from utils.validation import ValidationResult
+
+ANALYSIS = {
+    "shot_type": "full_shot",
+    "body_box": [10, 10, 90, 190],
+    "keypoints": {"l_ankle": [40, 185], "r_ankle": [60, 185], "nose": [50, 20], "hip": [50, 100]},
+    "perspective": {"horizon_y": 0.5},
+    "pose_type": "standing",
+}
+
+@pytest.fixture
+def fake_pipeline(tmp_path, monkeypatch):
+    """替换流水线中的上游调用：每轮生成耗时与校验得分按列表依次给出"""
+    img = np.full((200, 100, 3), 200, np.uint8)
+    cv2.rectangle(img, (30, 20), (70, 180), (20, 40, 60), -1)
+    character_path = str(tmp_path / "character.png")
+    reference_path = str(tmp_path / "reference.png")
+    cv2.imwrite(character_path, img)
+    cv2.imwrite(reference_path, img[:, ::-1].copy())
+
+    state = {"round_seconds": [], "scores": [], "generated": []}
+
+    def generate_image(self, **kwargs):
+        time.sleep(state["round_seconds"][len(state["generated"])])
+        output_path = str(tmp_path / f"generated_{len(state['generated'])}.png")
+        cv2.imwrite(output_path, img)
+        state["generated"].append(output_path)
+        return output_path
+
+    def comprehensive_validation(self, generated_image_path, analysis_result, character_path):
+        score = state["scores"][len(state["generated"]) - 1]
+        return {"shot_consistency": ValidationResult(False, score, "未通过")}
+
+    monkeypatch.setattr(main.VLMClient, "analyze_composition", lambda self, path: ANALYSIS)
+    monkeypatch.setattr(main.CharacterProfiler, "get_profile", lambda self, path, client: {"description": "test"})
+    monkeypatch.setattr(main.ImageGenerator, "generate_image", generate_image)
+    monkeypatch.setattr(main.ValidationEngine, "comprehensive_validation", comprehensive_validation)
+    monkeypatch.setattr(main, "_round_seconds_ema", None)
+    return character_path, reference_path, state
+
+def run_with_deadline(deadline, fn, *args):
+    token = activate_deadline(deadline)
+    try:
+        return fn(*args)
+    finally:
+        reset_deadline(token)
+
+def test_round_finishing_past_deadline_returns_best_round(fake_pipeline):
+    """第二轮结束时已超过预算：返回得分最高的第一轮，而不是报错"""
+    character_path, reference_path, state = fake_pipeline
+    state["round_seconds"] = [0.2, 0.9, 0.1]
+    state["scores"] = [0.5, 0.3, 0.1]
+
+    result = run_with_deadline(Deadline(1.0), main.run_pipeline, character_path, reference_path, None)
+
+    assert result["status"] == "success"
+    assert result["deadline_exceeded"] is True
+    assert result["generated_image_path"] == state["generated"][0]
+    assert result["retry_count"] == 0
+    assert len(state["generated"]) == 2
+
+def test_expired_before_first_round_raises(fake_pipeline):
+    character_path, reference_path, state = fake_pipeline
+    deadline = Deadline(0.0)
+    with pytest.raises(DeadlineExceeded):
+        run_with_deadline(deadline, main.run_pipeline, character_path, reference_path, None)
+    assert state["generated"] == []
+
+def test_cancelled_request_raises_even_with_completed_round(fake_pipeline, monkeypatch):
+    character_path, reference_path, state = fake_pipeline
+    state["round_seconds"] = [0.2, 0.2]
+    state["scores"] = [0.5, 0.3]
+    deadline = Deadline(60.0)
+
+    def cancel_after_first_round(self, generated_image_path, analysis_result, character_path):
+        deadline.cancel()
+        return {"shot_consistency": ValidationResult(False, 0.5, "未通过")}
+
+    monkeypatch.setattr(main.ValidationEngine, "comprehensive_validation", cancel_after_first_round)
+    with pytest.raises(RequestCancelled):
+        run_with_deadline(deadline, main.run_pipeline, character_path, reference_path, None)
+    assert len(state["generated"]) == 1
+
+@pytest.mark.parametrize("header", ["nan", "inf", "-inf", "-5", "abc", "", None])
+def test_invalid_request_timeout_falls_back_to_default(header, monkeypatch):
+    monkeypatch.setenv("REQUEST_DEADLINE_SECONDS", "120")
+    monkeypatch.setenv("REQUEST_DEADLINE_MAX_SECONDS", "300")
+    assert Deadline.from_request(header).budget == 120.0
+
+def test_request_timeout_is_capped(monkeypatch):
+    monkeypatch.setenv("REQUEST_DEADLINE_MAX_SECONDS", "300")
+    assert Deadline.from_request("30").budget == 30.0
+    assert Deadline.from_request("999").budget == 300.0
+
+def test_job_deadline_follows_latest_member_and_cancels_when_all_leave():
+    short, long = Deadline(1.0), Deadline(60.0)
+    job_deadline = JobDeadline()
+    job_deadline.join(short)
+    job_deadline.join(long)
+
+    assert job_deadline.remaining() > 30
+    short.cancel()
+    assert not job_deadline.cancelled
+    long.cancel()
+    assert job_deadline.cancelled
+    assert not job_deadline.leave(short)
+    assert job_deadline.leave(long)
+
+def run_in_thread(deadline, fn, *args):
+    """在独立线程中带截止时间执行，返回 (线程, 结果字典)"""
+    outcome = {}
+
+    def target():
+        try:
+            outcome["result"] = run_with_deadline(deadline, fn, *args)
+        except Exception as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    return thread, outcome
+
+def test_shared_call_runs_under_longest_waiter_deadline():
+    """短预算请求发起的共享调用，按同时等待的长预算请求的截止时间设置上游超时"""
+    flight = SingleFlight()
+    observed = {}
+
+    def shared_call():
+        time.sleep(0.3)
+        observed["timeout"] = upstream_timeout()
+        time.sleep(0.9)
+        check_deadline("共享调用")
+        return "analysis"
+
+    leader, leader_outcome = run_in_thread(Deadline(1.0), flight.do, "reference", shared_call)
+    time.sleep(0.1)
+    joiner, joiner_outcome = run_in_thread(Deadline(120.0), flight.do, "reference", shared_call)
+    leader.join()
+    joiner.join()
+
+    assert observed["timeout"] > 100
+    assert joiner_outcome.get("result") == "analysis"
+    assert flight.stats()["executed"] == 1
+
+def test_waiter_gives_up_on_its_own_budget_only():
+    """等待者按自己的预算超时，不影响共享执行与其他等待者"""
+    flight = SingleFlight()
+
+    def shared_call():
+        time.sleep(1.0)
+        return "analysis"
+
+    leader, leader_outcome = run_in_thread(Deadline(120.0), flight.do, "reference", shared_call)
+    time.sleep(0.1)
+    started = time.perf_counter()
+    joiner, joiner_outcome = run_in_thread(Deadline(0.3), flight.do, "reference", shared_call)
+    joiner.join()
+    waited = time.perf_counter() - started
+    leader.join()
+
+    assert isinstance(joiner_outcome.get("error"), DeadlineExceeded)
+    assert waited < 0.8
+    assert leader_outcome.get("result") == "analysis"
+
+def test_leader_cancellation_is_not_shared_with_waiters():
+    """发起共享调用的客户端断开后，仍有客户端在等待时共享调用继续执行"""
+    flight = SingleFlight()
+    leader_deadline = Deadline(120.0)
+
+    def shared_call():
+        time.sleep(0.3)
+        leader_deadline.cancel()
+        time.sleep(0.1)
+        check_deadline("共享调用")
+        return "analysis"
+
+    leader, leader_outcome = run_in_thread(leader_deadline, flight.do, "reference", shared_call)
+    time.sleep(0.1)
+    joiner, joiner_outcome = run_in_thread(Deadline(120.0), flight.do, "reference", shared_call)
+    leader.join()
+    joiner.join()
+
+    assert joiner_outcome.get("result") == "analysis"
+
+def test_job_follower_waits_only_for_its_own_budget():
+    """加入已在执行的任务的请求按自己的预算放弃等待，共享任务与发起者不受影响"""
+    flight = SingleFlight()
+
+    def job():
+        time.sleep(1.0)
+        return "result"
+
+    async def scenario():
+        leader_shared, leader = flight.start_async("job", job)
+        follower_shared, follower_is_leader = flight.start_async("job", job)
+        assert leader and not follower_is_leader
+
+        started = time.perf_counter()
+        with pytest.raises(DeadlineExceeded):
+            await wait_within_deadline(follower_shared, Deadline(0.3))
+        follower_waited = time.perf_counter() - started
+
+        leader_result = await wait_within_deadline(leader_shared, Deadline(10.0))
+        return follower_waited, leader_result
+
+    follower_waited, leader_result = asyncio.run(scenario())
+    assert follower_waited < 0.8
+    assert leader_result == "result"
+    assert flight.stats()["executed"] == 1
+
+def test_job_follower_stops_waiting_when_cancelled():
+    flight = SingleFlight()
+
+    async def scenario():
+        shared, _ = flight.start_async("job", time.sleep, 0.5)
+        deadline = Deadline(10.0)
+        asyncio.get_running_loop().call_later(0.1, deadline.cancel)
+        with pytest.raises(RequestCancelled):
+            await wait_within_deadline(shared, deadline)
+        await asyncio.shield(shared)
+
+    asyncio.run(scenario())
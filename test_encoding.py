@@ -0,0 +1,86 @@
+"""
+编码配置与文件编码缓存的单元测试
+"""
+import os
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import utils.encoding as encoding
+from utils.encoding import ImageEncoder
+
+@pytest.fixture
+def image_file(tmp_path):
+    path = str(tmp_path / "input.png")
+    cv2.imwrite(path, np.full((64, 64, 3), 200, np.uint8))
+    return path
+
+class FlakyCache:
+    """第一次读取返回 None（模拟读取失败），之后正常读取；可设置每次读取的耗时"""
+
+    def __init__(self, delay: float = 0.0, fail_first: bool = False):
+        self.delay = delay
+        self.fail_first = fail_first
+        self.reads = 0
+        self._lock = threading.Lock()
+
+    def imread(self, path):
+        with self._lock:
+            self.reads += 1
+            fail = self.fail_first and self.reads == 1
+        time.sleep(self.delay)
+        return None if fail else cv2.imread(path)
+
+def test_payload_profile_stays_within_target_bytes_for_noisy_image():
+    # 随机噪声几乎不可压缩，质量降到下限后仍需缩小尺寸才能满足预算
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, (1024, 1024, 3), dtype=np.uint8)
+    encoder = ImageEncoder()
+    target_bytes = encoder.profiles["payload"].target_bytes
+
+    data, mime = encoder.encode(img, "payload", "payload")
+
+    assert mime == "image/jpeg"
+    assert len(data) <= target_bytes
+
+def test_failed_file_encode_is_not_cached(image_file, monkeypatch):
+    cache = FlakyCache(fail_first=True)
+    monkeypatch.setattr(encoding, "get_image_cache", lambda: cache)
+    encoder = ImageEncoder()
+
+    first = encoder.encode_file_async(image_file, "payload", "payload")
+    with pytest.raises(Exception, match="无法读取图像文件"):
+        first.result()
+
+    second = encoder.encode_file_async(image_file, "payload", "payload")
+    data, _ = second.result()
+    assert second is not first
+    assert data
+    assert encoder.encode_file_async(image_file, "payload", "payload") is second
+
+def test_concurrent_file_encodes_share_one_future(image_file, monkeypatch):
+    cache = FlakyCache(delay=0.2)
+    monkeypatch.setattr(encoding, "get_image_cache", lambda: cache)
+    encoder = ImageEncoder()
+    start = threading.Barrier(8)
+    futures = []
+
+    def submit():
+        start.wait()
+        futures.append(encoder.encode_file_async(image_file, "payload", "payload"))
+
+    threads = [threading.Thread(target=submit) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len({id(future) for future in futures}) == 1
+    futures[0].result()
+    assert cache.reads == 1
@@ -0,0 +1,122 @@
+"""
+生成结果落盘（base64解码与URL下载）的单元测试
+"""
+import base64
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import utils.image_generator as image_generator
+from utils.image_generator import ImageGenerator
+
+def png_bytes() -> bytes:
+    img = np.zeros((32, 48, 3), np.uint8)
+    img[:, :24] = (0, 128, 255)
+    ok, buf = cv2.imencode(".png", img)
+    assert ok
+    return buf.tobytes()
+
+class FakeResponse:
+    def __init__(self, body: bytes, chunk_size: int = None, status_code: int = 200, headers=None):
+        self.body = body
+        self.chunk_size = chunk_size
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def iter_content(self, chunk_size=1):
+        size = self.chunk_size or chunk_size
+        for start in range(0, len(self.body), size):
+            yield self.body[start:start + size]
+
+class FakeSession:
+    def __init__(self, response: FakeResponse):
+        self.response = response
+
+    def get(self, url, stream=False, timeout=None):
+        return self.response
+
+@pytest.fixture
+def generator():
+    return ImageGenerator()
+
+def use_response(monkeypatch, response: FakeResponse):
+    monkeypatch.setattr(image_generator, "get_http_session", lambda: FakeSession(response))
+
+def test_write_base64_image_accepts_wrapped_lines(generator, tmp_path):
+    data = png_bytes()
+    encoded = base64.b64encode(data).decode()
+    # MIME 风格每76个字符换行
+    wrapped = "\r\n".join(encoded[i:i + 76] for i in range(0, len(encoded), 76))
+
+    output_path = generator._write_base64_image(wrapped, str(tmp_path / "result"))
+
+    assert output_path.endswith(".png")
+    with open(output_path, "rb") as f:
+        assert f.read() == data
+
+def test_write_base64_image_rejects_truncated_data(generator, tmp_path):
+    encoded = base64.b64encode(png_bytes()).decode()
+
+    with pytest.raises(Exception, match="不完整"):
+        generator._write_base64_image(encoded[:-3], str(tmp_path / "result"))
+    assert os.listdir(tmp_path) == []
+
+def test_write_base64_image_rejects_non_image_payload(generator, tmp_path):
+    encoded = base64.b64encode(b"Sorry, I cannot generate this image.").decode()
+
+    with pytest.raises(Exception, match="不是有效的图片"):
+        generator._write_base64_image(encoded, str(tmp_path / "result"))
+    assert os.listdir(tmp_path) == []
+
+def test_download_image_rejects_oversized_content_length(generator, tmp_path, monkeypatch):
+    monkeypatch.setenv("MAX_RESULT_BYTES", "100")
+    use_response(monkeypatch, FakeResponse(png_bytes(), headers={"Content-Length": "1000"}))
+
+    with pytest.raises(Exception, match="超过大小限制"):
+        generator._download_image("https://example.com/a.png", str(tmp_path / "result"))
+    assert os.listdir(tmp_path) == []
+
+def test_download_image_rejects_oversized_stream(generator, tmp_path, monkeypatch):
+    # 没有 Content-Length 时按实际收到的字节数限制
+    monkeypatch.setenv("MAX_RESULT_BYTES", "100")
+    use_response(monkeypatch, FakeResponse(png_bytes() + b"\0" * 200, chunk_size=64))
+
+    with pytest.raises(Exception, match="超过大小限制"):
+        generator._download_image("https://example.com/a.png", str(tmp_path / "result"))
+    assert os.listdir(tmp_path) == []
+
+def test_download_image_rejects_bad_header(generator, tmp_path, monkeypatch):
+    use_response(monkeypatch, FakeResponse(b"<html><body>Not Found</body></html>"))
+
+    with pytest.raises(Exception, match="不是有效的图片"):
+        generator._download_image("https://example.com/a.png", str(tmp_path / "result"))
+    assert os.listdir(tmp_path) == []
+
+def test_download_image_detects_header_split_across_chunks(generator, tmp_path, monkeypatch):
+    # WEBP 需要12字节才能识别，按3字节一块返回
+    body = b"RIFF\x24\x00\x00\x00WEBPVP8 " + b"\0" * 32
+    use_response(monkeypatch, FakeResponse(body, chunk_size=3))
+
+    output_path = generator._download_image("https://example.com/a.webp", str(tmp_path / "result"))
+
+    assert output_path.endswith(".webp")
+    with open(output_path, "rb") as f:
+        assert f.read() == body
+
+def test_save_generated_image_rejects_text_reply(generator, tmp_path, monkeypatch):
+    monkeypatch.setenv("OUTPUT_DIR", str(tmp_path))
+
+    with pytest.raises(Exception, match="没有图片数据或图片URL"):
+        generator.save_generated_image("抱歉，我无法生成这张图片。", 512, 512)
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,65 @@
+"""
+角色主体定位与自适应扩图的单元测试
+"""
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.outpaint import OutpaintEngine
+from utils.subject_detector import SubjectDetector
+
+# 参考图中完整的全身人物：脚踝在 body_box 底部附近
+FULL_SHOT_ANALYSIS = {
+    "body_box": [100, 20, 200, 420],
+    "keypoints": {"l_ankle": [130, 410], "r_ankle": [170, 410], "nose": [150, 40], "hip": [150, 220]},
+}
+
+def subject_off_bottom_edge(width: int) -> np.ndarray:
+    """白底上一个100px宽、从y=50一直延伸出画面下沿的主体"""
+    img = np.full((400, width, 3), 255, np.uint8)
+    x1 = width // 2 - 50
+    cv2.rectangle(img, (x1, 50), (x1 + 99, 399), (40, 60, 120), -1)
+    return img
+
+@pytest.mark.parametrize("width", [300, 800])
+def test_subject_running_off_bottom_edge_reaches_edge(width):
+    result = SubjectDetector()._detect_array(subject_off_bottom_edge(width))
+    x1, y1, x2, y2 = result["box"]
+
+    assert y2 == 400
+    assert abs(y1 - 50) <= 4
+    assert abs((x2 - x1) - 100) <= 6
+
+def test_narrow_canvas_subject_off_edge_plans_bottom_extension():
+    """窄画面上主体越出下沿时仍要规划向下扩图"""
+    img = subject_off_bottom_edge(300)
+    result = SubjectDetector()._detect_array(img)
+    pads = OutpaintEngine(fill_method="replicate").plan_extension(img.shape, FULL_SHOT_ANALYSIS, result["box"])
+
+    assert pads["bottom"] > 0
+
+def test_grabcut_box_extends_to_edge_when_foreground_touches_init_rect(monkeypatch):
+    """退回 GrabCut 时，前景碰到初始矩形边说明主体越出画面，边界框延伸到画面边缘"""
+    detector = SubjectDetector()
+    img = np.zeros((400, 300, 3), np.uint8)
+
+    def grabcut_mask(small):
+        h, w = small.shape[:2]
+        mx, my = detector._grabcut_margins(w, h)
+        mask = np.zeros((h, w), np.uint8)
+        # 前景从画面中部一直到初始矩形下边
+        mask[h // 8:h - my, w // 3:2 * w // 3] = 255
+        return mask
+
+    monkeypatch.setattr(detector, "_background_model_mask", lambda small: np.zeros(small.shape[:2], np.uint8))
+    monkeypatch.setattr(detector, "_grabcut_mask", grabcut_mask)
+    result = detector._detect_array(img)
+
+    assert result["method"] == "grabcut"
+    assert result["box"][3] == 400
+    assert 0 < result["box"][1] < 100
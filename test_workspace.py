@@ -0,0 +1,69 @@
+"""
+任务工作区的单元测试
+"""
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.encoding import get_image_encoder
+from utils.image_cache import get_image_cache, path_under
+from utils.subject_detector import get_subject_detector
+from utils.workspace import WorkspaceManager
+
+def test_release_drops_cache_entries_for_workspace_files(tmp_path, monkeypatch):
+    monkeypatch.setenv("WORKSPACE_ROOT", str(tmp_path / "workspaces"))
+    manager = WorkspaceManager()
+    workspace = manager.create("job1")
+    image_path = workspace.file_path("character.png")
+    img = np.full((120, 80, 3), 255, np.uint8)
+    cv2.rectangle(img, (20, 10), (60, 110), (40, 60, 120), -1)
+    cv2.imwrite(image_path, img)
+
+    # 工作区外的文件不受影响
+    outside_path = str(tmp_path / "outside.png")
+    cv2.imwrite(outside_path, img)
+
+    cache, detector, encoder = get_image_cache(), get_subject_detector(), get_image_encoder()
+    for path in (image_path, outside_path):
+        assert cache.imread(path) is not None
+        detector.detect(path)
+        encoder.encode_file_async(path, "payload", "payload").result()
+
+    workspace.release()
+
+    assert not os.path.exists(workspace.path)
+    for keys in (cache._entries, detector._results, encoder._file_futures):
+        paths = [key[0] for key in keys]
+        assert not any(path_under(path, workspace.path) for path in paths)
+        assert os.path.abspath(outside_path) in paths
+
+def test_path_under_does_not_match_sibling_prefix(tmp_path):
+    directory = str(tmp_path / "rsf_job1")
+    assert path_under(os.path.join(directory, "a.png"), directory)
+    assert not path_under(str(tmp_path / "rsf_job10" / "a.png"), directory)
+
+def test_sweep_prunes_least_recently_used_profiles(tmp_path, monkeypatch):
+    profile_dir = tmp_path / "profiles"
+    profile_dir.mkdir()
+    monkeypatch.setenv("WORKSPACE_ROOT", str(tmp_path / "workspaces"))
+    monkeypatch.setenv("OUTPUT_DIR", str(tmp_path / "output"))
+    monkeypatch.setenv("CHARACTER_PROFILE_CACHE_DIR", str(profile_dir))
+    monkeypatch.setenv("CHARACTER_PROFILE_CACHE_RETENTION_SECONDS", "3600")
+    monkeypatch.setenv("CHARACTER_PROFILE_CACHE_MAX_FILES", "2")
+
+    now = time.time()
+    ages = {"expired": 7200, "oldest": 300, "older": 200, "recent": 100}
+    for name, age in ages.items():
+        path = profile_dir / f"{name}.json"
+        path.write_text("{}")
+        os.utime(path, (now - age, now - age))
+
+    result = WorkspaceManager().sweep()
+
+    assert result["removed_profiles"] == 2
+    assert sorted(os.listdir(profile_dir)) == ["older.json", "recent.json"]
@@ -0,0 +1,213 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional
+
+# 优先级类别，数值越小越先被调度
+PRIORITY_CLASSES = {"high": 0, "normal": 1, "low": 2}
+# 用于计算等待时间分位数的滑动窗口大小
+WAIT_SAMPLE_WINDOW = 1000
+
+class AdmissionRejected(Exception):
+    """
+    请求未被准入：429 表示该客户端超出配额，503 表示服务整体过载
+    """
+
+    def __init__(self, status_code: int, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+class _Waiter:
+    __slots__ = ("client_key", "priority", "future", "enqueued_at")
+
+    def __init__(self, client_key: str, priority: str, future: asyncio.Future):
+        self.client_key = client_key
+        self.priority = priority
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+class AdmissionController:
+    """
+    准入控制
+
+    限制全局与单个 API Key 的并发数；超出并发的请求进入有界的优先级队列等待，
+    队列已满、单客户端排队过多或等待超时则立即以 429/503 + Retry-After 拒绝，
+    保证已准入请求的延迟不随过载而增长。只在事件循环线程中使用，无需加锁。
+    """
+
+    def __init__(self, max_concurrent: int = 8, per_key_concurrent: int = 2,
+                 max_queue: int = 32, per_key_queue: int = 4, max_wait: float = 30.0):
+        self.max_concurrent = max_concurrent
+        self.per_key_concurrent = per_key_concurrent
+        self.max_queue = max_queue
+        self.per_key_queue = per_key_queue
+        self.max_wait = max_wait
+
+        self._active = 0
+        self._active_per_key: Dict[str, int] = defaultdict(int)
+        self._queued = 0
+        self._queued_per_key: Dict[str, int] = defaultdict(int)
+        self._waiters = []
+        self._sequence = itertools.count()
+
+        self._counters = defaultdict(int)
+        self._wait_samples = deque(maxlen=WAIT_SAMPLE_WINDOW)
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        # 单个请求处理时长的指数滑动平均，用于估算 Retry-After
+        self._service_time_ema: Optional[float] = None
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        return cls(
+            max_concurrent=int(os.getenv("ADMISSION_MAX_CONCURRENT", 8)),
+            per_key_concurrent=int(os.getenv("ADMISSION_PER_KEY_CONCURRENT", 2)),
+            max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", 32)),
+            per_key_queue=int(os.getenv("ADMISSION_PER_KEY_QUEUE", 4)),
+            max_wait=float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", 30)),
+        )
+
+    @asynccontextmanager
+    async def admit(self, client_key: str, priority: str = "normal"):
+        """
+        获取执行名额，退出上下文时归还；无法准入时抛出 AdmissionRejected
+        """
+        await self._acquire(client_key, priority)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._release(client_key, time.perf_counter() - started)
+
+    async def _acquire(self, client_key: str, priority: str) -> None:
+        if priority not in PRIORITY_CLASSES:
+            priority = "normal"
+
+        # 有空闲名额且没有人在排队时直接准入
+        if (self._queued == 0 and self._active < self.max_concurrent
+                and self._active_per_key.get(client_key, 0) < self.per_key_concurrent):
+            self._grant_immediately(client_key)
+            return
+
+        if self._queued_per_key.get(client_key, 0) >= self.per_key_queue:
+            self._counters["rejected_client_quota"] += 1
+            raise AdmissionRejected(429, self._estimate_retry_after(), "该客户端排队请求过多，请稍后重试")
+        if self._queued >= self.max_queue:
+            self._counters["rejected_queue_full"] += 1
+            raise AdmissionRejected(503, self._estimate_retry_after(), "服务繁忙，请稍后重试")
+
+        waiter = _Waiter(client_key, priority, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._waiters, (PRIORITY_CLASSES[priority], next(self._sequence), waiter))
+        self._queued += 1
+        self._queued_per_key[client_key] += 1
+        self._dispatch()
+
+        try:
+            await asyncio.wait_for(waiter.future, timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            self._counters["rejected_wait_timeout"] += 1
+            raise AdmissionRejected(503, self._estimate_retry_after(), "排队等待超时，请稍后重试")
+        except asyncio.CancelledError:
+            # 已经分到名额后才被取消，需要归还名额
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release(client_key, 0.0)
+            else:
+                self._abandon(waiter)
+            raise
+
+    def _grant_immediately(self, client_key: str) -> None:
+        self._active += 1
+        self._active_per_key[client_key] += 1
+        self._counters["admitted"] += 1
+        self._record_wait(0.0)
+
+    def _dispatch(self) -> None:
+        """
+        按优先级把名额分配给排队请求；所属客户端已达并发上限的请求跳过，保留在队列中
+        """
+        skipped = []
+        while self._waiters and self._active < self.max_concurrent:
+            entry = heapq.heappop(self._waiters)
+            waiter = entry[2]
+            if waiter.future.done():
+                # 已超时或被取消的请求，惰性删除
+                continue
+            if self._active_per_key.get(waiter.client_key, 0) >= self.per_key_concurrent:
+                skipped.append(entry)
+                continue
+
+            self._abandon(waiter)
+            self._active += 1
+            self._active_per_key[waiter.client_key] += 1
+            self._counters["admitted"] += 1
+            self._record_wait(time.perf_counter() - waiter.enqueued_at)
+            waiter.future.set_result(True)
+
+        for entry in skipped:
+            heapq.heappush(self._waiters, entry)
+
+    def _abandon(self, waiter: _Waiter) -> None:
+        """请求离开队列（被准入、超时或取消）时更新排队计数"""
+        self._queued -= 1
+        self._queued_per_key[waiter.client_key] -= 1
+        if self._queued_per_key[waiter.client_key] <= 0:
+            self._queued_per_key.pop(waiter.client_key, None)
+
+    def _release(self, client_key: str, service_time: float) -> None:
+        self._active -= 1
+        self._active_per_key[client_key] -= 1
+        if self._active_per_key[client_key] <= 0:
+            self._active_per_key.pop(client_key, None)
+        if service_time > 0:
+            if self._service_time_ema is None:
+                self._service_time_ema = service_time
+            else:
+                self._service_time_ema = 0.8 * self._service_time_ema + 0.2 * service_time
+        self._dispatch()
+
+    def _record_wait(self, seconds: float) -> None:
+        self._wait_samples.append(seconds)
+        self._wait_total += seconds
+        self._wait_max = max(self._wait_max, seconds)
+
+    def _estimate_retry_after(self) -> int:
+        """按平均处理时长与排队深度估算客户端应等待的秒数"""
+        service_time = self._service_time_ema or 10.0
+        waves = (self._queued + 1) / max(self.max_concurrent, 1)
+        return int(min(120, max(1, math.ceil(service_time * waves))))
+
+    def metrics(self) -> Dict[str, Any]:
+        """队列深度、并发与等待时间指标"""
+        samples = sorted(self._wait_samples)
+
+        def percentile(p: float) -> float:
+            if not samples:
+                return 0.0
+            return round(samples[min(len(samples) - 1, int(len(samples) * p))], 4)
+
+        admitted = self._counters["admitted"]
+        return {
+            "active": self._active,
+            "queue_depth": self._queued,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "admitted": admitted,
+            "rejected_client_quota": self._counters["rejected_client_quota"],
+            "rejected_queue_full": self._counters["rejected_queue_full"],
+            "rejected_wait_timeout": self._counters["rejected_wait_timeout"],
+            "wait_seconds": {
+                "avg": round(self._wait_total / admitted, 4) if admitted else 0.0,
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+                "max": round(self._wait_max, 4),
+            },
+            "service_seconds_ema": round(self._service_time_ema, 4) if self._service_time_ema else None,
+        }
@@ -0,0 +1,168 @@
+import cv2
+import hashlib
+import json
+import numpy as np
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from .image_cache import get_image_cache
+from .subject_detector import get_subject_detector
+from .single_flight import SingleFlight
+
+# 提取主色时的下采样尺寸与聚类数
+COLOR_SAMPLE_SIDE = 64
+DOMINANT_COLOR_COUNT = 3
+# 进程内最多保留的档案数
+MAX_MEMORY_PROFILES = 1024
+# 缓存格式版本，特征提取逻辑变化时递增以让旧缓存失效
+PROFILE_VERSION = 1
+
+def file_content_hash(file_path: str) -> str:
+    """按文件内容计算sha256，同一张角色图无论文件名如何都得到相同的键"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def format_character_features(profile: Dict[str, Any]) -> str:
+    """
+    把角色档案整理为Prompt中的角色特征文本
+    """
+    parts = []
+    if profile.get("description"):
+        parts.append(profile["description"].rstrip("."))
+    colors = profile.get("dominant_colors") or []
+    if colors:
+        color_text = ", ".join(f"{c['hex']} ({c['ratio']:.0%})" for c in colors)
+        parts.append(f"dominant colors: {color_text}")
+    if profile.get("aspect_ratio"):
+        parts.append(f"body aspect ratio (w/h): {profile['aspect_ratio']:.2f}")
+    if not parts:
+        return "Character features from uploaded image"
+    return "; ".join(parts)
+
+class CharacterProfiler:
+    """
+    角色档案
+
+    对每张角色图只做一次VLM外观描述，并提取主色、主体宽高比、主体框等本地特征，
+    以图片内容哈希为键持久化到磁盘（CHARACTER_PROFILE_CACHE_DIR），
+    回头客的角色图不再产生额外调用。缓存目录的大小由 WorkspaceManager 的后台清理限制。
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.cache_dir = cache_dir or os.getenv("CHARACTER_PROFILE_CACHE_DIR", "cache/character_profiles")
+        self.image_cache = get_image_cache()
+        self.subject_detector = get_subject_detector()
+
+    def get_profile(self, character_image_path: str, vlm_client) -> Dict[str, Any]:
+        """
+        获取角色档案，依次查询内存缓存、磁盘缓存，都未命中时才提取特征并调用VLM
+        """
+        content_hash = file_content_hash(character_image_path)
+        # 同一角色图的并发请求共享一次特征提取与VLM描述
+        return _profile_flight.do(content_hash, self._resolve_profile,
+                                  content_hash, character_image_path, vlm_client)
+
+    def _resolve_profile(self, content_hash: str, character_image_path: str, vlm_client) -> Dict[str, Any]:
+        with _memory_profiles_lock:
+            profile = _memory_profiles.get(content_hash)
+        if profile is None:
+            profile = self._load(content_hash)
+
+        if profile is None:
+            profile = self.extract_local_features(character_image_path)
+            profile["content_hash"] = content_hash
+
+        if not profile.get("description"):
+            # 描述失败不影响主流程，下次请求会重试
+            try:
+                profile["description"] = vlm_client.describe_character(character_image_path)
+            except Exception:
+                profile["description"] = ""
+            if profile["description"]:
+                profile["created_at"] = int(time.time())
+                self._save(content_hash, profile)
+
+        # 不同角色图的流水线线程会并发更新，按LRU顺序淘汰
+        with _memory_profiles_lock:
+            _memory_profiles[content_hash] = profile
+            _memory_profiles.move_to_end(content_hash)
+            while len(_memory_profiles) > MAX_MEMORY_PROFILES:
+                _memory_profiles.popitem(last=False)
+        return profile
+
+    def extract_local_features(self, character_image_path: str) -> Dict[str, Any]:
+        """
+        提取本地特征：主体框、主体宽高比、主体区域的主色
+        """
+        img = self.image_cache.imread(character_image_path)
+        if img is None:
+            raise Exception(f"无法读取角色图: {character_image_path}")
+        h, w = img.shape[:2]
+
+        detection = self.subject_detector.detect(character_image_path)
+        x1, y1, x2, y2 = detection["box"]
+        subject = img[y1:y2, x1:x2] if x2 > x1 and y2 > y1 else img
+
+        return {
+            "version": PROFILE_VERSION,
+            "image_size": [w, h],
+            "subject_box": detection["box"],
+            "aspect_ratio": round((x2 - x1) / max(y2 - y1, 1), 4),
+            "dominant_colors": self._dominant_colors(subject),
+            "description": "",
+        }
+
+    def _dominant_colors(self, img: np.ndarray):
+        """在下采样后的主体区域上做k-means，返回按占比排序的主色"""
+        if img.ndim == 2:
+            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        small = cv2.resize(img, (COLOR_SAMPLE_SIDE, COLOR_SAMPLE_SIDE), interpolation=cv2.INTER_AREA)
+        samples = small.reshape(-1, 3).astype(np.float32)
+
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 1.0)
+        _, labels, centers = cv2.kmeans(samples, DOMINANT_COLOR_COUNT, None, criteria, 1, cv2.KMEANS_PP_CENTERS)
+        counts = np.bincount(labels.flatten(), minlength=DOMINANT_COLOR_COUNT)
+
+        colors = []
+        for idx in np.argsort(-counts):
+            b, g, r = (int(v) for v in centers[idx])
+            colors.append({"hex": f"#{r:02x}{g:02x}{b:02x}", "ratio": round(float(counts[idx] / counts.sum()), 3)})
+        return colors
+
+    def _profile_path(self, content_hash: str) -> str:
+        return os.path.join(self.cache_dir, f"{content_hash}.json")
+
+    def _load(self, content_hash: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._profile_path(content_hash), "r", encoding="utf-8") as f:
+                profile = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        if profile.get("version") != PROFILE_VERSION:
+            return None
+        # 刷新修改时间，后台清理按修改时间淘汰最久未用的档案
+        try:
+            os.utime(self._profile_path(content_hash))
+        except OSError:
+            pass
+        return profile
+
+    def _save(self, content_hash: str, profile: Dict[str, Any]) -> None:
+        # 先写临时文件再原子替换，多worker并发写同一档案也不会读到半个文件
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._profile_path(content_hash)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(profile, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+# 进程内的档案缓存，命中时连磁盘都不用读
+_memory_profiles: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_memory_profiles_lock = threading.Lock()
+_profile_flight = SingleFlight()
@@ -0,0 +1,172 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Optional, Set
+
+import requests
+
+# 当前任务的截止时间，通过 contextvars 传到流水线线程，上游调用据此设置超时
+_current_deadline: ContextVar[Optional["Deadline"]] = ContextVar("current_deadline", default=None)
+
+# 上游调用的最短超时，剩余时间过短时仍给连接建立留出余量
+MIN_UPSTREAM_TIMEOUT = 1.0
+# 异步等待共享结果时检查是否已取消的间隔（秒）
+ASYNC_WAIT_POLL_SECONDS = 0.5
+
+class DeadlineExceeded(Exception):
+    """请求的时间预算已用完"""
+
+class RequestCancelled(Exception):
+    """客户端已断开，任务被取消"""
+
+# 时间预算或取消导致的错误（上游调用按剩余时间设置超时，超时也算在内）
+DEADLINE_ERRORS = (DeadlineExceeded, RequestCancelled, requests.exceptions.Timeout)
+
+class Deadline:
+    """
+    单个请求的截止时间与取消标记
+
+    截止时间由事件循环线程创建，流水线线程在阶段之间调用 check()，
+    上游HTTP调用通过 timeout() 取剩余时间作为超时。
+    """
+
+    def __init__(self, seconds: float):
+        self.budget = seconds
+        self.expires_at = time.monotonic() + seconds
+        self._cancelled = threading.Event()
+        self.cancel_reason: Optional[str] = None
+
+    @classmethod
+    def from_request(cls, requested: Optional[str]) -> "Deadline":
+        """
+        按客户端给出的秒数（X-Request-Timeout）创建，未给出或无效时使用 REQUEST_DEADLINE_SECONDS，
+        并以 REQUEST_DEADLINE_MAX_SECONDS 为上限
+        """
+        default = float(os.getenv("REQUEST_DEADLINE_SECONDS", 120))
+        maximum = float(os.getenv("REQUEST_DEADLINE_MAX_SECONDS", 300))
+        try:
+            seconds = float(requested) if requested else default
+        except ValueError:
+            seconds = default
+        # nan/inf 也视为无效，否则会绕过 <= 0 与上限检查
+        if not math.isfinite(seconds) or seconds <= 0:
+            seconds = default
+        return cls(min(seconds, maximum))
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self, reason: str = "client_disconnected") -> None:
+        self.cancel_reason = reason
+        self._cancelled.set()
+
+    def check(self, stage: str = "") -> None:
+        """已取消或已超时时抛出异常，流水线在每个阶段之前调用"""
+        if self.cancelled:
+            raise RequestCancelled(f"客户端已断开，任务在 {stage or '当前阶段'} 之前取消")
+        if self.expired():
+            raise DeadlineExceeded(f"请求超过时间预算 {self.budget:g} 秒，在 {stage or '当前阶段'} 之前停止")
+
+    def allows(self, estimated_seconds: float) -> bool:
+        """剩余时间是否足够完成一个预计耗时为 estimated_seconds 的步骤"""
+        return not self.cancelled and self.remaining() >= estimated_seconds
+
+    def timeout(self, cap: Optional[float] = None) -> float:
+        """上游调用的超时：剩余时间（不超过 cap）"""
+        self.check()
+        remaining = self.remaining()
+        if math.isinf(remaining):
+            return cap
+        remaining = max(remaining, MIN_UPSTREAM_TIMEOUT)
+        return min(remaining, cap) if cap else remaining
+
+class JobDeadline(Deadline):
+    """
+    合并执行的任务的截止时间：取所有等待该任务的请求中最晚的截止时间，
+    全部请求都已断开时才取消，避免一个客户端断开影响共享同一结果的其他请求。
+    没有截止时间的等待者（join(None)）使任务不受时间限制
+    """
+
+    def __init__(self):
+        super().__init__(0.0)
+        self._members: Set[Deadline] = set()
+        self._unbounded = 0
+        self._lock = threading.Lock()
+
+    def join(self, deadline: Optional[Deadline]) -> None:
+        with self._lock:
+            if deadline is None:
+                self._unbounded += 1
+                return
+            self._members.add(deadline)
+            self.budget = max(self.budget, deadline.budget)
+
+    def leave(self, deadline: Optional[Deadline]) -> bool:
+        """移除一个请求，返回是否已没有请求在等待"""
+        with self._lock:
+            if deadline is None:
+                self._unbounded = max(0, self._unbounded - 1)
+            else:
+                self._members.discard(deadline)
+            return not self._members and not self._unbounded
+
+    def remaining(self) -> float:
+        with self._lock:
+            if self._unbounded:
+                return math.inf
+            members = list(self._members)
+        if not members:
+            return 0.0
+        return max(member.remaining() for member in members)
+
+    @property
+    def cancelled(self) -> bool:
+        with self._lock:
+            if self._unbounded:
+                return False
+            members = list(self._members)
+        return bool(members) and all(member.cancelled for member in members)
+
+def activate_deadline(deadline: Deadline):
+    """设为当前上下文的截止时间，返回用于 reset_deadline 的 token"""
+    return _current_deadline.set(deadline)
+
+def reset_deadline(token) -> None:
+    _current_deadline.reset(token)
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+def check_deadline(stage: str = "") -> None:
+    """当前上下文有截止时间时检查是否已取消或超时"""
+    deadline = _current_deadline.get()
+    if deadline is not None:
+        deadline.check(stage)
+
+def upstream_timeout(default: Optional[float] = None) -> Optional[float]:
+    """
+    上游HTTP调用的超时：有截止时间时取剩余时间（不超过 default），否则使用 default
+    """
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return default
+    return deadline.timeout(default)
+
+async def wait_within_deadline(future: "asyncio.Future", deadline: Deadline, stage: str = "等待合并的任务") -> Any:
+    """
+    按请求自己的截止时间等待共享结果：超时或客户端断开时抛出异常，但不取消 future 本身
+    """
+    while not future.done():
+        deadline.check(stage)
+        await asyncio.wait({future}, timeout=min(max(deadline.remaining(), 0.01), ASYNC_WAIT_POLL_SECONDS))
+    return future.result()
@@ -0,0 +1,282 @@
+import cv2
+import math
+import numpy as np
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Any, Optional, Tuple
+
+from .image_cache import get_image_cache, path_under
+from .raw_frame import RAW_FRAME_EXT, RAW_FRAME_HEADER_SIZE, write_raw_frame
+
+# 各格式对应的扩展名与MIME类型
+FORMAT_EXTENSIONS = {"raw": RAW_FRAME_EXT, "png": ".png", "jpeg": ".jpg", "webp": ".webp"}
+FORMAT_MIME_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+EXTENSION_FORMATS = {".png": "png", ".jpg": "jpeg", ".jpeg": "jpeg", ".webp": "webp", RAW_FRAME_EXT: "raw"}
+# 按字节预算搜索质量时的最多尝试次数
+MAX_QUALITY_SEARCH_STEPS = 6
+# 最低质量仍超出字节预算时，继续缩小尺寸的最多次数与最短边下限
+MAX_DOWNSCALE_STEPS = 4
+MIN_DOWNSCALE_SIDE = 256
+
+class EncodingProfile:
+    """
+    编码配置：格式、质量/压缩等级、最长边限制与目标字节数
+
+    format 为 "source" 时按输出文件扩展名决定格式（仅用于写文件）
+    """
+
+    def __init__(self, name: str, format: str, quality: int = 90, min_quality: int = 50,
+                 png_compression: int = 3, max_side: Optional[int] = None,
+                 target_bytes: Optional[int] = None):
+        self.name = name
+        self.format = format
+        self.quality = quality
+        self.min_quality = min_quality
+        self.png_compression = png_compression
+        self.max_side = max_side
+        self.target_bytes = target_bytes
+
+    @property
+    def ext(self) -> Optional[str]:
+        return FORMAT_EXTENSIONS.get(self.format)
+
+def load_profiles() -> Dict[str, EncodingProfile]:
+    """
+    从环境变量构造三种编码配置：
+    internal - 流水线中间产物，原始帧或低压缩等级PNG，追求最快
+    payload  - 发送给生图API的图片，缩小到 PAYLOAD_MAX_SIDE（未设置时取 MAX_IMAGE_DIMENSION）并压到 PAYLOAD_TARGET_BYTES 以内
+    archival - 需要长期保存的结果，默认无损PNG
+    """
+    internal_format = "raw" if os.getenv("INTERMEDIATE_FORMAT", "raw").lower() == "raw" else "source"
+    return {
+        "internal": EncodingProfile("internal", internal_format, quality=95, png_compression=1),
+        "payload": EncodingProfile(
+            "payload",
+            os.getenv("PAYLOAD_FORMAT", "jpeg").lower(),
+            quality=int(os.getenv("PAYLOAD_QUALITY", 90)),
+            min_quality=int(os.getenv("PAYLOAD_MIN_QUALITY", 50)),
+            max_side=int(os.getenv("PAYLOAD_MAX_SIDE") or os.getenv("MAX_IMAGE_DIMENSION", 1024)),
+            target_bytes=int(os.getenv("PAYLOAD_TARGET_BYTES", 400 * 1024)),
+        ),
+        "archival": EncodingProfile(
+            "archival",
+            os.getenv("ARCHIVAL_FORMAT", "png").lower(),
+            quality=95,
+            png_compression=int(os.getenv("ARCHIVAL_PNG_COMPRESSION", 6)),
+        ),
+    }
+
+def _encode_params(fmt: str, profile: EncodingProfile, quality: int):
+    if fmt == "png":
+        return [cv2.IMWRITE_PNG_COMPRESSION, profile.png_compression]
+    if fmt == "jpeg":
+        return [cv2.IMWRITE_JPEG_QUALITY, quality]
+    if fmt == "webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, quality]
+    raise ValueError(f"不支持的编码格式: {fmt}")
+
+def _encode_with_quality_search(img: np.ndarray, profile: EncodingProfile, fmt: str) -> np.ndarray:
+    """
+    按配置质量编码；超出目标字节数时对质量做二分搜索，取不超预算的最高质量，
+    都超预算时返回最小的结果（最低质量）
+    """
+    ext = FORMAT_EXTENSIONS[fmt]
+    ok, buffer = cv2.imencode(ext, img, _encode_params(fmt, profile, profile.quality))
+    if not ok:
+        raise Exception(f"图像编码失败: {fmt}")
+    if fmt == "png" or not profile.target_bytes or buffer.nbytes <= profile.target_bytes:
+        return buffer
+
+    # 超出预算，在 [min_quality, quality) 区间二分查找
+    best = None
+    smallest = buffer
+    low, high = profile.min_quality, profile.quality - 1
+    for _ in range(MAX_QUALITY_SEARCH_STEPS):
+        if low > high:
+            break
+        quality = (low + high) // 2
+        ok, candidate = cv2.imencode(ext, img, _encode_params(fmt, profile, quality))
+        if not ok:
+            high = quality - 1
+            continue
+        if candidate.nbytes < smallest.nbytes:
+            smallest = candidate
+        if candidate.nbytes <= profile.target_bytes:
+            best = candidate
+            low = quality + 1
+        else:
+            high = quality - 1
+    if best is not None:
+        return best
+
+    # 搜索步数用完仍未达标时，确保至少尝试过最低质量
+    ok, candidate = cv2.imencode(ext, img, _encode_params(fmt, profile, profile.min_quality))
+    if ok and candidate.nbytes < smallest.nbytes:
+        smallest = candidate
+    return smallest
+
+def encode_array(img: np.ndarray, profile: EncodingProfile, fmt: Optional[str] = None) -> bytes:
+    """
+    按编码配置把图像编码为字节；有目标字节数时先降质量，最低质量仍超预算时再逐步缩小尺寸
+    """
+    fmt = fmt or profile.format
+    if profile.max_side:
+        h, w = img.shape[:2]
+        scale = profile.max_side / max(h, w)
+        if scale < 1.0:
+            img = cv2.resize(img, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+
+    if fmt == "raw":
+        raise ValueError("原始帧请使用 write_raw_frame 写入文件")
+
+    buffer = _encode_with_quality_search(img, profile, fmt)
+    for _ in range(MAX_DOWNSCALE_STEPS):
+        if fmt == "png" or not profile.target_bytes or buffer.nbytes <= profile.target_bytes:
+            break
+        # 字节数大致与像素数成正比，按面积比例缩小，每步缩放限制在 [0.5, 0.9]
+        h, w = img.shape[:2]
+        scale = min(0.9, max(0.5, math.sqrt(profile.target_bytes / buffer.nbytes)))
+        if min(h, w) * scale < MIN_DOWNSCALE_SIDE:
+            break
+        img = cv2.resize(img, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+        buffer = _encode_with_quality_search(img, profile, fmt)
+    return buffer.tobytes()
+
+class ImageEncoder:
+    """
+    图像编码器
+
+    统一按编码配置写文件或生成字节，可提交到后台线程池执行，使编码与上游网络I/O重叠；
+    按阶段统计原始字节数、编码后字节数与节省的字节数。
+    对文件的 payload 编码按 (路径, mtime, 大小, 配置) 缓存，重试轮次不会重复编码。
+    """
+
+    def __init__(self, max_workers: int = 2):
+        self.max_workers = max_workers
+        self.profiles = load_profiles()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+        self._file_futures: Dict[Tuple[str, int, int, str], Future] = {}
+        self._stats: Dict[str, Dict[str, float]] = defaultdict(
+            lambda: {"count": 0, "input_bytes": 0, "output_bytes": 0, "saved_bytes": 0, "seconds": 0.0}
+        )
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # 线程池按进程创建，预加载模式下fork后的worker重新建池
+        pid = os.getpid()
+        with self._lock:
+            if self._executor is None or self._executor_pid != pid:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="encoder")
+                self._executor_pid = pid
+            return self._executor
+
+    def _record(self, stage: str, input_bytes: int, output_bytes: int, seconds: float) -> None:
+        with self._lock:
+            item = self._stats[stage]
+            item["count"] += 1
+            item["input_bytes"] += input_bytes
+            item["output_bytes"] += output_bytes
+            item["saved_bytes"] += input_bytes - output_bytes
+            item["seconds"] += seconds
+
+    def extension_for(self, profile_name: str, source_ext: str) -> str:
+        """按配置决定输出扩展名，"source" 格式沿用原扩展名"""
+        return self.profiles[profile_name].ext or source_ext
+
+    def write(self, output_path: str, img: np.ndarray, profile_name: str, stage: str) -> str:
+        """
+        按配置同步写文件，格式由配置决定（"source" 配置按扩展名决定）
+        """
+        profile = self.profiles[profile_name]
+        started = time.perf_counter()
+        fmt = profile.format
+        if fmt == "source":
+            fmt = EXTENSION_FORMATS.get(os.path.splitext(output_path)[1].lower(), "png")
+
+        if fmt == "raw":
+            write_raw_frame(output_path, img)
+            output_bytes = img.nbytes + RAW_FRAME_HEADER_SIZE
+        else:
+            data = encode_array(img, profile, fmt)
+            with open(output_path, "wb") as f:
+                f.write(data)
+            output_bytes = len(data)
+
+        self._record(stage, img.nbytes, output_bytes, time.perf_counter() - started)
+        return output_path
+
+    def encode(self, img: np.ndarray, profile_name: str, stage: str,
+               source_bytes: Optional[int] = None) -> Tuple[bytes, str]:
+        """
+        按配置编码为字节，返回 (字节, MIME类型)；source_bytes 为原文件大小时按其计算节省量
+        """
+        profile = self.profiles[profile_name]
+        started = time.perf_counter()
+        data = encode_array(img, profile)
+        input_bytes = source_bytes if source_bytes is not None else img.nbytes
+        self._record(stage, input_bytes, len(data), time.perf_counter() - started)
+        return data, FORMAT_MIME_TYPES[profile.format]
+
+    def encode_file_async(self, image_path: str, profile_name: str, stage: str) -> Future:
+        """
+        在后台线程中读取并编码文件，立即返回 Future；同一文件同一配置只编码一次
+        """
+        stat = os.stat(image_path)
+        key = (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size, profile_name)
+
+        def task():
+            img = get_image_cache().imread(image_path)
+            if img is None:
+                raise Exception(f"无法读取图像文件: {image_path}")
+            return self.encode(img, profile_name, stage, source_bytes=stat.st_size)
+
+        executor = self._get_executor()
+        with self._lock:
+            future = self._file_futures.get(key)
+            if future is not None:
+                return future
+            # 只保留最近的若干个结果，避免无界增长
+            while len(self._file_futures) >= 64:
+                self._file_futures.pop(next(iter(self._file_futures)))
+            # 查找与提交在同一把锁内完成，避免两个线程同时为同一文件提交编码
+            future = executor.submit(task)
+            self._file_futures[key] = future
+
+        # 失败的结果不缓存，下次调用重新编码（回调可能在当前线程立即执行，须在锁外注册）
+        future.add_done_callback(lambda done: self._forget_failed(key, done))
+        return future
+
+    def _forget_failed(self, key: Tuple[str, int, int, str], future: Future) -> None:
+        if future.cancelled() or future.exception() is not None:
+            with self._lock:
+                if self._file_futures.get(key) is future:
+                    del self._file_futures[key]
+
+    def invalidate_directory(self, directory: str) -> None:
+        """移除某个目录下所有文件的编码结果"""
+        with self._lock:
+            for k in [k for k in self._file_futures if path_under(k[0], directory)]:
+                del self._file_futures[k]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                stage: {**item, "seconds": round(item["seconds"], 4)}
+                for stage, item in self._stats.items()
+            }
+
+_shared_encoder: Optional[ImageEncoder] = None
+_shared_encoder_lock = threading.Lock()
+
+def get_image_encoder() -> ImageEncoder:
+    """获取进程级共享的编码器（线程数由 ENCODER_THREADS 配置）"""
+    global _shared_encoder
+    if _shared_encoder is None:
+        with _shared_encoder_lock:
+            if _shared_encoder is None:
+                _shared_encoder = ImageEncoder(max_workers=int(os.getenv("ENCODER_THREADS", 2)))
+    return _shared_encoder
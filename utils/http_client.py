@@ -0,0 +1,30 @@
+import os
+import threading
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+_session: Optional[requests.Session] = None
+_session_pid: Optional[int] = None
+_session_lock = threading.Lock()
+
+def get_http_session() -> requests.Session:
+    """
+    获取进程级共享的连接池会话，VLM调用、生图调用与结果下载复用同一组长连接
+
+    会话在首次使用时按进程创建，预加载模式下fork出的worker不会继承master的连接
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                pool_size = int(os.getenv("HTTP_POOL_SIZE", 32))
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+                _session_pid = pid
+    return _session
@@ -0,0 +1,141 @@
+import cv2
+import numpy as np
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from .raw_frame import is_raw_frame, read_raw_frame
+
+# 默认缓存上限：256MB 解码后的像素数据
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+def load_image(image_path: str) -> Optional[np.ndarray]:
+    """
+    读取图像：内部原始帧直接内存映射，其余格式交给cv2解码
+    """
+    if is_raw_frame(image_path):
+        try:
+            return read_raw_frame(image_path)
+        except (OSError, ValueError):
+            return None
+    return cv2.imread(image_path)
+
+def path_under(path: str, directory: str) -> bool:
+    """绝对路径 path 是否位于 directory 目录之下"""
+    directory = os.path.abspath(directory)
+    return path == directory or path.startswith(directory.rstrip(os.sep) + os.sep)
+
+class ImageCache:
+    """
+    解码图像缓存
+
+    以 (绝对路径, mtime, 文件大小) 为键缓存 cv2 解码结果，按字节数计量，
+    超出上限时按 LRU 淘汰。返回的数组均为只读视图，各阶段共享同一块内存，
+    需要修改像素的调用方必须自行 copy()。
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, int, int], np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _make_key(self, image_path: str) -> Optional[Tuple[str, int, int]]:
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return None
+        return (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size)
+
+    def imread(self, image_path: str) -> Optional[np.ndarray]:
+        """
+        读取图像，命中缓存时直接返回只读视图；文件不存在或无法解码时返回None（与cv2.imread一致）
+        """
+        key = self._make_key(image_path)
+        if key is None:
+            return None
+
+        with self._lock:
+            img = self._entries.get(key)
+            if img is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return img
+            self.misses += 1
+
+        img = load_image(image_path)
+        if img is None:
+            return None
+
+        if img.flags.writeable:
+            img.setflags(write=False)
+        self._put(key, img)
+        return img
+
+    def _put(self, key: Tuple[str, int, int], img: np.ndarray) -> None:
+        size = img.nbytes
+        if size > self.max_bytes:
+            # 单张图超过上限，不缓存
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old.nbytes
+
+            # 同一路径的旧版本（mtime变化）已失效，一并移除
+            stale = [k for k in self._entries if k[0] == key[0]]
+            for k in stale:
+                self.current_bytes -= self._entries.pop(k).nbytes
+
+            self._entries[key] = img
+            self.current_bytes += size
+
+            while self.current_bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+
+    def invalidate(self, image_path: str) -> None:
+        """移除某个路径的所有缓存版本"""
+        abs_path = os.path.abspath(image_path)
+        with self._lock:
+            for k in [k for k in self._entries if k[0] == abs_path]:
+                self.current_bytes -= self._entries.pop(k).nbytes
+
+    def invalidate_directory(self, directory: str) -> None:
+        """移除某个目录下所有文件的缓存（任务工作区删除后释放对应的内存映射）"""
+        with self._lock:
+            for k in [k for k in self._entries if path_under(k[0], directory)]:
+                self.current_bytes -= self._entries.pop(k).nbytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "current_bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+# 进程级共享缓存，供 ImageProcessor 与 ValidationEngine 等各阶段共用
+_shared_cache: Optional[ImageCache] = None
+_shared_cache_lock = threading.Lock()
+
+def get_image_cache() -> ImageCache:
+    """获取进程级共享的解码图像缓存（上限由 IMAGE_CACHE_MAX_BYTES 配置）"""
+    global _shared_cache
+    if _shared_cache is None:
+        with _shared_cache_lock:
+            if _shared_cache is None:
+                max_bytes = int(os.getenv("IMAGE_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+                _shared_cache = ImageCache(max_bytes=max_bytes)
+    return _shared_cache
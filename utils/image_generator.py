@@ -1,9 +1,37 @@
-import requests
-import json
 import base64
-from typing import Dict, Any, Optional
+import re
+import uuid
+from typing import Optional
 from dotenv import load_dotenv
 import os
+import time
+
+from .encoding import get_image_encoder
+from .http_client import get_http_session
+from .deadline import check_deadline, upstream_timeout
+from .profiling import traced
+from .workspace import track_artifact
+
+# 流式下载/解码的块大小
+STREAM_CHUNK_SIZE = 64 * 1024
+# base64每次解码的字符数（必须是4的倍数）
+BASE64_CHUNK_CHARS = 4 * 64 * 1024
+# 识别图片格式所需的文件头字节数
+IMAGE_HEADER_BYTES = 16
+
+def detect_image_format(head: bytes) -> Optional[str]:
+    """
+    根据文件头魔数判断图片格式，返回对应扩展名，无法识别时返回None
+    """
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return ".png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return ".jpg"
+    if len(head) >= 12 and head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return ".gif"
+    return None
 
 # 加载环境变量
 load_dotenv()
@@ -17,12 +45,24 @@ class ImageGenerator:
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.api_key}"
         }
+        self.encoder = get_image_encoder()
 
     def encode_image(self, image_path: str) -> str:
-        """将图片编码为base64字符串"""
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+        """将图片编码为base64字符串（按 payload 编码配置缩放并压缩）"""
+        data, _ = self.encoder.encode_file_async(image_path, "payload", "payload").result()
+        return base64.b64encode(data).decode('utf-8')
 
+    def prefetch_payload(self, image_path: str, stage: str = "payload"):
+        """
+        提前在后台线程中编码待发送的图片，与上游网络请求重叠进行，返回 Future
+        """
+        return self.encoder.encode_file_async(image_path, "payload", stage)
+
+    def _payload_image_url(self, image_path: str, stage: str) -> str:
+        data, mime_type = self.prefetch_payload(image_path, stage).result()
+        return f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
+
+    @traced("ImageGenerator.generate_image")
     def generate_image(self, 
                      prompt: str, 
                      reference_image_path: Optional[str] = None,
@@ -55,22 +95,26 @@ class ImageGenerator:
             }
         ]
         
+        # 两张图在后台线程中并行编码（重试轮次直接复用已编码结果）
+        if reference_image_path:
+            self.prefetch_payload(reference_image_path, "payload.reference")
+        if character_image_path:
+            self.prefetch_payload(character_image_path, "payload.character")
+        
         # 如果有参考图或角色图，添加到消息中
         if reference_image_path:
-            base64_ref_image = self.encode_image(reference_image_path)
             messages[0]["content"].append({
                 "type": "image_url",
                 "image_url": {
-                    "url": f"data:image/jpeg;base64,{base64_ref_image}"
+                    "url": self._payload_image_url(reference_image_path, "payload.reference")
                 }
             })
         
         if character_image_path:
-            base64_char_image = self.encode_image(character_image_path)
             messages[0]["content"].append({
                 "type": "image_url",
                 "image_url": {
-                    "url": f"data:image/jpeg;base64,{base64_char_image}"
+                    "url": self._payload_image_url(character_image_path, "payload.character")
                 }
             })
         
@@ -83,7 +127,9 @@ class ImageGenerator:
             "response_format": {"type": "image", "image": {"size": f"{width}x{height}"}}
         }
         
-        response = requests.post(self.base_url, headers=self.headers, json=payload)
+        # 超时取当前请求剩余的时间预算
+        response = get_http_session().post(self.base_url, headers=self.headers, json=payload,
+                                           timeout=upstream_timeout())
         
         if response.status_code != 200:
             raise Exception(f"图像生成API调用失败: {response.status_code} - {response.text}")
@@ -119,31 +165,147 @@ class ImageGenerator:
     def save_generated_image(self, image_data: str, width: int, height: int) -> str:
         """
         保存生成的图像
+        
+        支持 data:image 形式的base64内容（分块解码写盘）和URL形式的结果（连接池流式下载），
+        两种方式都会校验图片文件头，并受 MAX_RESULT_BYTES 大小限制
         """
-        # 简化处理：实际应用中需要根据API返回格式处理
-        # 这里假设image_data是base64编码的图像数据
-        import time
         timestamp = int(time.time())
-        output_path = f"output/generated_image_{timestamp}.jpg"
+        # 同一秒内的并发请求也不能互相覆盖
+        output_dir = os.getenv("OUTPUT_DIR", "output")
+        output_stem = os.path.join(output_dir, f"generated_image_{timestamp}_{uuid.uuid4().hex[:8]}")
         
         # 确保输出目录存在
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        os.makedirs(os.path.dirname(output_stem), exist_ok=True)
         
-        # 如果image_data是base64格式，保存为图片
+        image_url = self._extract_image_url(image_data)
         if image_data.startswith("data:image"):
             # 提取base64部分
             header, encoded = image_data.split(",", 1)
-            image_bytes = base64.b64decode(encoded)
-            
-            with open(output_path, "wb") as f:
-                f.write(image_bytes)
+            output_path = self._write_base64_image(encoded, output_stem)
+        elif image_url:
+            output_path = self._download_image(image_url, output_stem)
         else:
-            # 如果是URL或其他格式，需要根据实际API返回格式处理
-            # 这里简化处理，创建一个占位图片
-            import cv2
-            import numpy as np
-            img = np.zeros((height, width, 3), dtype=np.uint8)
-            img[:] = (100, 100, 100)  # 灰色占位图
-            cv2.imwrite(output_path, img)
-        
-        return output_path
\ No newline at end of file
+            # 既不是base64也不是URL（例如模型返回了文字说明或拒绝），不能用占位图冒充生成结果，
+            # 直接报错，交给重试循环或错误响应处理
+            preview = (image_data or "").strip()[:200]
+            raise Exception(f"生成结果中没有图片数据或图片URL: {preview}")
+        
+        # 生成结果计入任务工作区配额，由输出目录的保留策略统一清理
+        track_artifact(output_path)
+        return output_path
+
+    def _extract_image_url(self, image_data: str) -> Optional[str]:
+        """
+        从返回内容中提取图片URL（兼容纯URL与Markdown图片语法）
+        """
+        match = re.search(r"https?://[^\s)\]\"'<>]+", image_data)
+        return match.group(0) if match else None
+
+    def _max_result_bytes(self) -> int:
+        return int(os.getenv("MAX_RESULT_BYTES", 32 * 1024 * 1024))
+
+    def _write_base64_image(self, encoded: str, output_stem: str) -> str:
+        """
+        分块解码base64并写入磁盘，不在内存中同时保留完整的解码结果
+        """
+        encoded = encoded.strip()
+        if len(encoded) * 3 // 4 > self._max_result_bytes():
+            raise Exception(f"生成结果超过大小限制: {self._max_result_bytes()} 字节")
+        
+        part_path = f"{output_stem}.part"
+        image_ext = None
+        try:
+            with open(part_path, "wb") as f:
+                # 换行折行（MIME风格）的base64中夹有空白：逐块去掉空白，
+                # 不足4的倍数的尾部字符留到下一块一起解码
+                carry = ""
+                for start in range(0, len(encoded), BASE64_CHUNK_CHARS):
+                    piece = carry + "".join(encoded[start:start + BASE64_CHUNK_CHARS].split())
+                    usable = len(piece) - len(piece) % 4
+                    carry = piece[usable:]
+                    if not usable:
+                        continue
+                    chunk = base64.b64decode(piece[:usable])
+                    if image_ext is None:
+                        image_ext = detect_image_format(chunk[:IMAGE_HEADER_BYTES])
+                        if image_ext is None:
+                            raise Exception("生成结果不是有效的图片数据")
+                    f.write(chunk)
+                if carry:
+                    raise Exception("生成结果的base64数据不完整")
+        except Exception:
+            self._remove_quietly(part_path)
+            raise
+        
+        if image_ext is None:
+            self._remove_quietly(part_path)
+            raise Exception("生成结果为空")
+        
+        output_path = f"{output_stem}{image_ext}"
+        os.replace(part_path, output_path)
+        return output_path
+
+    def _download_image(self, image_url: str, output_stem: str) -> str:
+        """
+        用连接池流式下载URL形式的生成结果，按块写盘并限制总大小
+        """
+        max_bytes = self._max_result_bytes()
+        timeout = upstream_timeout(float(os.getenv("RESULT_DOWNLOAD_TIMEOUT", 60)))
+        part_path = f"{output_stem}.part"
+        image_ext = None
+        received = 0
+        
+        try:
+            with get_http_session().get(image_url, stream=True, timeout=timeout) as response:
+                if response.status_code != 200:
+                    raise Exception(f"生成结果下载失败: {response.status_code}")
+                
+                content_length = response.headers.get("Content-Length")
+                if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+                    raise Exception(f"生成结果超过大小限制: {content_length} > {max_bytes} 字节")
+                
+                with open(part_path, "wb") as f:
+                    # 首个块可能很短（WEBP需要12字节才能识别），先攒够文件头再检查格式
+                    head = b""
+                    for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                        if not chunk:
+                            continue
+                        received += len(chunk)
+                        # 单次读取超时不限制总耗时，按块检查截止时间
+                        check_deadline("生成结果下载")
+                        if received > max_bytes:
+                            raise Exception(f"生成结果超过大小限制: {max_bytes} 字节")
+                        if image_ext is None:
+                            head += chunk
+                            if len(head) < IMAGE_HEADER_BYTES:
+                                continue
+                            image_ext = self._check_download_header(head, image_url)
+                            chunk, head = head, b""
+                        f.write(chunk)
+                    if image_ext is None and head:
+                        # 整个内容不足文件头长度
+                        image_ext = self._check_download_header(head, image_url)
+                        f.write(head)
+        except Exception:
+            self._remove_quietly(part_path)
+            raise
+        
+        if image_ext is None:
+            self._remove_quietly(part_path)
+            raise Exception(f"下载内容为空: {image_url}")
+        
+        output_path = f"{output_stem}{image_ext}"
+        os.replace(part_path, output_path)
+        return output_path
+
+    def _check_download_header(self, head: bytes, image_url: str) -> str:
+        image_ext = detect_image_format(head[:IMAGE_HEADER_BYTES])
+        if image_ext is None:
+            raise Exception(f"下载内容不是有效的图片: {image_url}")
+        return image_ext
+
+    def _remove_quietly(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -2,18 +2,49 @@ import cv2
 import numpy as np
 from PIL import Image
 import os
-from typing import Dict, Tuple, List, Any
+from typing import Dict, Tuple, List, Any, Optional
 import math
 
+from .image_cache import get_image_cache
+from .encoding import get_image_encoder
+from .outpaint import OutpaintEngine
+from .subject_detector import get_subject_detector
+from .profiling import traced
+from .workspace import track_artifact
+
 class ImageProcessor:
     def __init__(self):
-        pass
+        # 共享的解码缓存，同一次请求中各阶段重复读取的图像只解码一次
+        self.image_cache = get_image_cache()
+        # 中间产物按 internal 编码配置写出（默认未压缩原始帧，内存映射读取）
+        self.encoder = get_image_encoder()
+        self.outpaint_engine = OutpaintEngine()
+        # 角色主体定位结果按图片缓存，裁切与扩图都依据角色自身的主体范围
+        self.subject_detector = get_subject_detector()
+
+    def _intermediate_path(self, image_path: str, suffix: str) -> str:
+        """
+        生成中间产物的输出路径
+        """
+        dir_path, file_name = os.path.split(image_path)
+        name, ext = os.path.splitext(file_name)
+        ext = self.encoder.extension_for("internal", ext)
+        return os.path.join(dir_path, f"{name}_{suffix}{ext}")
+
+    def _save_intermediate(self, output_path: str, img: np.ndarray, stage: str = "intermediate") -> str:
+        """
+        保存中间产物，原始帧格式跳过编码，只有最终产物才需要压缩
+        """
+        self.encoder.write(output_path, img, "internal", stage=f"internal.{stage}")
+        track_artifact(output_path)
+        return output_path
 
-    def resize_image(self, image_path: str, max_size: int = 1024) -> str:
+    def resize_image(self, image_path: str, max_size: Optional[int] = None) -> str:
         """
-        调整图片大小，保持宽高比，最长边不超过max_size
+        调整图片大小，保持宽高比，最长边不超过max_size（默认取 MAX_IMAGE_DIMENSION，与前端上传前的缩放一致）
         """
-        img = cv2.imread(image_path)
+        max_size = max_size or int(os.getenv("MAX_IMAGE_DIMENSION", 1024))
+        img = self.image_cache.imread(image_path)
         h, w = img.shape[:2]
         
         # 计算缩放比例
@@ -24,54 +55,57 @@ class ImageProcessor:
         resized_img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
         
         # 生成输出路径
-        dir_path, file_name = os.path.split(image_path)
-        name, ext = os.path.splitext(file_name)
-        output_path = os.path.join(dir_path, f"{name}_resized{ext}")
+        output_path = self._intermediate_path(image_path, "resized")
         
-        cv2.imwrite(output_path, resized_img)
-        return output_path
+        return self._save_intermediate(output_path, resized_img, "resized")
 
     def outpaint_image(self, image_path: str, target_size: Tuple[int, int], 
                       position: str = "bottom") -> str:
         """
         扩图功能 - 在图片边缘扩展背景
         """
-        img = cv2.imread(image_path)
+        img = self.image_cache.imread(image_path)
         h, w = img.shape[:2]
         target_w, target_h = target_size
         
-        # 计算需要扩展的尺寸
-        if position == "bottom":
-            # 向下扩展，保持上部内容
-            new_img = np.zeros((target_h, target_w, 3), dtype=np.uint8)
-            new_img[:] = (255, 255, 255)  # 白色背景
-            new_img[:h, :w] = img
-        elif position == "center":
+        # 计算需要扩展的尺寸，扩展区域由扩图引擎填充（边缘复制/修复），不再铺白色画布
+        pad_h, pad_w = max(0, target_h - h), max(0, target_w - w)
+        if position == "center":
             # 居中放置，四周扩展
-            new_img = np.zeros((target_h, target_w, 3), dtype=np.uint8)
-            new_img[:] = (255, 255, 255)  # 白色背景
-            start_y = (target_h - h) // 2
-            start_x = (target_w - w) // 2
-            new_img[start_y:start_y+h, start_x:start_x+w] = img
+            pads = {"top": pad_h // 2, "bottom": pad_h - pad_h // 2,
+                    "left": pad_w // 2, "right": pad_w - pad_w // 2}
         else:
-            # 默认扩展方式
-            new_img = np.zeros((target_h, target_w, 3), dtype=np.uint8)
-            new_img[:] = (255, 255, 255)  # 白色背景
-            new_img[:h, :w] = img
+            # 向下（默认）扩展，保持上部内容
+            pads = {"top": 0, "bottom": pad_h, "left": 0, "right": pad_w}
+        new_img = self.outpaint_engine.extend(img, pads)
             
         # 生成输出路径
-        dir_path, file_name = os.path.split(image_path)
-        name, ext = os.path.splitext(file_name)
-        output_path = os.path.join(dir_path, f"{name}_outpainted{ext}")
+        output_path = self._intermediate_path(image_path, "outpainted")
         
-        cv2.imwrite(output_path, new_img)
-        return output_path
+        return self._save_intermediate(output_path, new_img, "outpainted")
+
+    def smart_outpaint(self, image_path: str, analysis_result: Dict[str, Any],
+                       subject_box: List[int] = None) -> str:
+        """
+        自适应扩图 - 根据参考图人物与角色主体范围计算实际需要的扩展量，无需扩图时返回原路径
+        """
+        img = self.image_cache.imread(image_path)
+        pads = self.outpaint_engine.plan_extension(img.shape, analysis_result, subject_box)
+        if not any(pads.values()):
+            return image_path
+
+        new_img = self.outpaint_engine.extend(img, pads)
+
+        # 生成输出路径
+        output_path = self._intermediate_path(image_path, "outpainted")
+        
+        return self._save_intermediate(output_path, new_img, "outpainted")
 
     def crop_image(self, image_path: str, crop_box: Tuple[int, int, int, int]) -> str:
         """
         根据边界框裁切图片
         """
-        img = cv2.imread(image_path)
+        img = self.image_cache.imread(image_path)
         x1, y1, x2, y2 = crop_box
         
         # 确保边界框在图片范围内
@@ -84,18 +118,53 @@ class ImageProcessor:
         cropped_img = img[y1:y2, x1:x2]
         
         # 生成输出路径
-        dir_path, file_name = os.path.split(image_path)
-        name, ext = os.path.splitext(file_name)
-        output_path = os.path.join(dir_path, f"{name}_cropped{ext}")
+        output_path = self._intermediate_path(image_path, "cropped")
         
-        cv2.imwrite(output_path, cropped_img)
+        return self._save_intermediate(output_path, cropped_img, "cropped")
+
+    @traced("ImageProcessor.crop_to_subject")
+    def crop_to_subject(self, image_path: str, margin: float = 0.08) -> str:
+        """
+        按检测到的角色主体边界框紧凑裁切（四周保留少量边距），去掉无关背景以减小生图输入
+        """
+        detection = self.subject_detector.detect(image_path)
+        if detection["confidence"] <= 0:
+            return image_path
+
+        img = self.image_cache.imread(image_path)
+        h, w = img.shape[:2]
+        x1, y1, x2, y2 = detection["box"]
+        pad_x, pad_y = int((x2 - x1) * margin), int((y2 - y1) * margin)
+        x1, y1 = max(0, x1 - pad_x), max(0, y1 - pad_y)
+        x2, y2 = min(w, x2 + pad_x), min(h, y2 + pad_y)
+
+        # 裁切收益太小时保留原图，省去一次写盘
+        if (x2 - x1) * (y2 - y1) >= 0.95 * w * h:
+            return image_path
+
+        output_path = self._intermediate_path(image_path, "subject")
+        self._save_intermediate(output_path, img[y1:y2, x1:x2], "subject")
+
+        # 检测结果换算到裁切后的坐标系，避免对新图重复检测
+        bx1, by1, bx2, by2 = detection["box"]
+        keypoints = {
+            name: ([pt[0] - x1, pt[1] - y1] if pt else None)
+            for name, pt in detection["keypoints"].items()
+        }
+        self.subject_detector.remember(output_path, {
+            "box": [bx1 - x1, by1 - y1, bx2 - x1, by2 - y1],
+            "keypoints": keypoints,
+            "confidence": detection["confidence"],
+            "method": detection["method"],
+        })
         return output_path
 
+    @traced("ImageProcessor.apply_perspective_transform")
     def apply_perspective_transform(self, image_path: str, analysis_result: Dict[str, Any]) -> str:
         """
         应用透视变换，根据分析结果调整角色图的透视
         """
-        img = cv2.imread(image_path)
+        img = self.image_cache.imread(image_path)
         h, w = img.shape[:2]
         
         # 获取透视信息
@@ -135,18 +204,16 @@ class ImageProcessor:
             scaled_img = cv2.warpAffine(scaled_img, matrix, (new_w, new_h))
         
         # 生成输出路径
-        dir_path, file_name = os.path.split(image_path)
-        name, ext = os.path.splitext(file_name)
-        output_path = os.path.join(dir_path, f"{name}_perspective_adjusted{ext}")
+        output_path = self._intermediate_path(image_path, "perspective_adjusted")
         
-        cv2.imwrite(output_path, scaled_img)
-        return output_path
+        return self._save_intermediate(output_path, scaled_img, "perspective_adjusted")
 
     def apply_character_mask(self, reference_image_path: str, body_box: List[int]) -> str:
         """
         对参考图中的原人物应用遮罩和高斯模糊，实现语义特征隔离
         """
-        img = cv2.imread(reference_image_path)
+        # 缓存返回只读视图，这里需要原地修改像素，先复制一份
+        img = self.image_cache.imread(reference_image_path).copy()
         
         # 提取人物区域
         x1, y1, x2, y2 = body_box
@@ -166,60 +233,46 @@ class ImageProcessor:
         img[y1:y2, x1:x2] = blurred_region
         
         # 生成输出路径
-        dir_path, file_name = os.path.split(reference_image_path)
-        name, ext = os.path.splitext(file_name)
-        output_path = os.path.join(dir_path, f"{name}_masked{ext}")
+        output_path = self._intermediate_path(reference_image_path, "masked")
         
-        cv2.imwrite(output_path, img)
-        return output_path
+        return self._save_intermediate(output_path, img, "masked")
 
+    @traced("ImageProcessor.adjust_character_proportions")
     def adjust_character_proportions(self, character_image_path: str, analysis_result: Dict[str, Any]) -> str:
         """
         根据分析结果调整角色图的部位完整度
         """
         shot_type = analysis_result.get("shot_type", "medium_shot")
-        keypoints = analysis_result.get("keypoints", {})
         
-        # 检查角色图是否缺少脚部（用于判断是否需要扩图）
-        character_img = cv2.imread(character_image_path)
+        character_img = self.image_cache.imread(character_image_path)
         char_h, char_w = character_img.shape[:2]
+        # 角色自身的主体范围与关键点估计（已缓存）
+        detection = self.subject_detector.detect(character_image_path)
+        subject_box = detection["box"]
         
-        # 检查是否缺少脚部
-        ankles_present = False
-        if "l_ankle" in keypoints and "r_ankle" in keypoints:
-            l_ankle = keypoints["l_ankle"]
-            r_ankle = keypoints["r_ankle"]
-            # 如果脚踝坐标在参考图中存在，检查角色图是否需要扩展
-            if l_ankle and r_ankle:
-                # 简单判断：如果角色图高度小于参考图中人物的脚部位置，则需要扩图
-                avg_ankle_y = (l_ankle[1] + r_ankle[1]) / 2
-                # 这里假设参考图和角色图的比例关系
-                # 实际应用中需要更精确的尺寸对比
-                ankles_present = True
-        
-        if shot_type == "full_shot" and not ankles_present:
-            # 需要扩图补全腿部
-            # 这里简化处理，实际应用中需要更精确的判断
-            target_h = int(char_h * 1.5)  # 假设需要增加50%的高度
-            target_w = char_w
-            return self.outpaint_image(character_image_path, (target_w, target_h), position="bottom")
+        if shot_type == "full_shot":
+            # 全景：对比参考图人物(body_box/脚踝)与角色主体范围，按需补全腿部
+            return self.smart_outpaint(character_image_path, analysis_result, subject_box)
         elif shot_type == "closeup":
-            # 需要裁切为特写
-            nose_pos = keypoints.get("nose", [char_w//2, char_h//3])
+            # 需要裁切为特写，以角色自身的鼻子位置为中心（而非参考图中的坐标）
+            nose_pos = detection["keypoints"].get("nose") or [char_w//2, char_h//3]
             center_x, center_y = nose_pos[0], nose_pos[1]
             
-            # 计算裁切区域，以鼻子为中心
-            crop_size = min(char_w, char_h) // 2
-            x1 = max(0, center_x - crop_size//2)
-            y1 = max(0, center_y - crop_size//2)
-            x2 = min(char_w, x1 + crop_size)
-            y2 = min(char_h, y1 + crop_size)
+            # 计算裁切区域：头肩范围约为主体宽度，不超过图片短边
+            box_w = subject_box[2] - subject_box[0]
+            box_h = subject_box[3] - subject_box[1]
+            crop_size = min(char_w, char_h, max(box_w, box_h // 3, 32))
+            x1 = min(max(0, center_x - crop_size//2), char_w - crop_size)
+            y1 = min(max(0, center_y - crop_size//2), char_h - crop_size)
+            x2 = x1 + crop_size
+            y2 = y1 + crop_size
             
             return self.crop_image(character_image_path, (x1, y1, x2, y2))
         else:
             # 中景或其他情况，可能需要轻微调整
             return character_image_path
 
+    @traced("ImageProcessor.create_adapted_reference")
     def create_adapted_reference(self, reference_image_path: str, analysis_result: Dict[str, Any]) -> str:
         """
         创建适配后的参考图，对原人物进行遮罩处理
@@ -0,0 +1,136 @@
+import os
+import threading
+from collections import defaultdict, deque
+from typing import Dict, Any, List, Optional
+
+# 每个层级保留的最近耗时样本数，用于计算分位数
+LATENCY_SAMPLE_WINDOW = 1000
+
+VALID_SHOT_TYPES = {"full_shot", "medium_shot", "closeup"}
+
+def _as_point(value) -> Optional[List[float]]:
+    try:
+        x, y = value
+        return [float(x), float(y)]
+    except (TypeError, ValueError):
+        return None
+
+def check_analysis_sanity(result: Dict[str, Any], width: int, height: int,
+                          min_confidence: float, tolerance: float) -> Optional[str]:
+    """
+    对构图分析结果做置信度与几何合理性检查，通过时返回 None，否则返回未通过的原因
+
+    - confidence 不低于阈值（缺失视为不通过）
+    - body_box 坐标有序且落在图像范围内
+    - 各关键点落在 body_box 内（按框尺寸的 tolerance 比例放宽）
+    - horizon_y 在 [0, 1] 内，景别取值合法
+    """
+    try:
+        confidence = float(result.get("confidence"))
+    except (TypeError, ValueError):
+        return "missing_confidence"
+    if confidence < min_confidence:
+        return "low_confidence"
+
+    if result.get("shot_type") not in VALID_SHOT_TYPES:
+        return "invalid_shot_type"
+
+    try:
+        x1, y1, x2, y2 = [float(v) for v in result["body_box"]]
+    except (TypeError, ValueError):
+        return "invalid_body_box"
+    if x2 <= x1 or y2 <= y1:
+        return "invalid_body_box"
+    margin_x, margin_y = width * tolerance, height * tolerance
+    if x1 < -margin_x or y1 < -margin_y or x2 > width + margin_x or y2 > height + margin_y:
+        return "box_outside_image"
+
+    box_margin_x, box_margin_y = (x2 - x1) * tolerance, (y2 - y1) * tolerance
+    for name, value in result["keypoints"].items():
+        point = _as_point(value)
+        if point is None:
+            return "invalid_keypoint"
+        px, py = point
+        if not (x1 - box_margin_x <= px <= x2 + box_margin_x and y1 - box_margin_y <= py <= y2 + box_margin_y):
+            return "keypoint_outside_box"
+
+    try:
+        horizon_y = float(result["perspective"].get("horizon_y"))
+    except (TypeError, ValueError):
+        return "invalid_horizon"
+    if not 0.0 <= horizon_y <= 1.0:
+        return "invalid_horizon"
+
+    return None
+
+class CascadeStats:
+    """
+    模型级联统计：按层级记录调用次数、结果被采用次数（命中率）、升级原因、错误数与耗时分位数
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, int] = defaultdict(int)
+        self._accepted: Dict[str, int] = defaultdict(int)
+        self._errors: Dict[str, int] = defaultdict(int)
+        self._escalations: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._latencies: Dict[str, deque] = defaultdict(lambda: deque(maxlen=LATENCY_SAMPLE_WINDOW))
+        self._latency_total: Dict[str, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def record(self, tier: str, seconds: float, accepted: bool = False,
+               escalation_reason: Optional[str] = None, error: bool = False) -> None:
+        with self._lock:
+            self._calls[tier] += 1
+            self._latencies[tier].append(seconds)
+            self._latency_total[tier] += seconds
+            if accepted:
+                self._accepted[tier] += 1
+            if error:
+                self._errors[tier] += 1
+            if escalation_reason:
+                self._escalations[tier][escalation_reason] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            tiers = {}
+            for tier, calls in self._calls.items():
+                samples = sorted(self._latencies[tier])
+
+                def percentile(p: float) -> float:
+                    if not samples:
+                        return 0.0
+                    return round(samples[min(len(samples) - 1, int(len(samples) * p))], 4)
+
+                accepted = self._accepted.get(tier, 0)
+                tiers[tier] = {
+                    "calls": calls,
+                    "accepted": accepted,
+                    "hit_rate": round(accepted / calls, 4) if calls else 0.0,
+                    "errors": self._errors.get(tier, 0),
+                    "escalations": dict(self._escalations.get(tier, {})),
+                    "latency_seconds": {
+                        "avg": round(self._latency_total[tier] / calls, 4) if calls else 0.0,
+                        "p50": percentile(0.5),
+                        "p95": percentile(0.95),
+                    },
+                }
+            return tiers
+
+_shared_stats: Optional[CascadeStats] = None
+_shared_stats_lock = threading.Lock()
+
+def get_cascade_stats() -> CascadeStats:
+    """获取进程级共享的级联统计"""
+    global _shared_stats
+    if _shared_stats is None:
+        with _shared_stats_lock:
+            if _shared_stats is None:
+                _shared_stats = CascadeStats()
+    return _shared_stats
+
+def cascade_settings() -> Dict[str, float]:
+    """从环境变量读取级联检查参数"""
+    return {
+        "min_confidence": float(os.getenv("VLM_CASCADE_MIN_CONFIDENCE", 0.6)),
+        "tolerance": float(os.getenv("VLM_CASCADE_TOLERANCE", 0.1)),
+    }
@@ -0,0 +1,135 @@
+import cv2
+import numpy as np
+import os
+from typing import Dict, Any, Optional, List
+
+# 扩图填充时，参与修复的接缝上下文宽度（像素）
+SEAM_CONTEXT = 16
+# 修复带下采样后的最长边，控制 cv2.inpaint 的计算量
+INPAINT_BAND_MAX_SIDE = 192
+
+class OutpaintEngine:
+    """
+    自适应扩图引擎
+
+    根据参考图中占位人物的 body_box / 脚踝关键点与角色图中主体的实际范围，
+    计算真正需要补全的边距，并用边缘复制或下采样修复的方式廉价地填充，
+    代替固定的 1.5 倍白色画布。
+    """
+
+    def __init__(self, fill_method: Optional[str] = None, max_extension_ratio: Optional[float] = None):
+        self.fill_method = (fill_method or os.getenv("OUTPAINT_FILL", "inpaint")).lower()
+        self.max_extension_ratio = float(
+            max_extension_ratio if max_extension_ratio is not None
+            else os.getenv("OUTPAINT_MAX_EXTENSION_RATIO", 0.5)
+        )
+
+    def plan_extension(self, image_shape, analysis_result: Dict[str, Any],
+                       subject_box: Optional[List[int]] = None) -> Dict[str, int]:
+        """
+        计算角色图四周需要扩展的像素数
+
+        Args:
+            image_shape: 角色图的 shape
+            analysis_result: 参考图分析结果（body_box、keypoints）
+            subject_box: 角色图中主体的边界框，未知时视为整张图
+
+        Returns:
+            {"top", "bottom", "left", "right"} 扩展像素数，全部为0表示无需扩图
+        """
+        pads = {"top": 0, "bottom": 0, "left": 0, "right": 0}
+        char_h, char_w = image_shape[:2]
+
+        body_box = analysis_result.get("body_box") or []
+        if len(body_box) != 4:
+            return pads
+        bx1, by1, bx2, by2 = body_box
+        ref_w, ref_h = bx2 - bx1, by2 - by1
+        if ref_w <= 0 or ref_h <= 0:
+            return pads
+
+        # 参考图中人物从头顶到脚踝的高度；脚踝关键点缺失时用整个 body_box
+        keypoints = analysis_result.get("keypoints", {})
+        ankles = [keypoints.get(k) for k in ("l_ankle", "r_ankle")]
+        ankles = [a for a in ankles if a and len(a) == 2]
+        if ankles:
+            ankle_y = sum(a[1] for a in ankles) / len(ankles)
+            # 脚踝以下保留少量边距放脚
+            ref_body_h = max(ankle_y - by1, 0) * 1.05
+            ref_body_h = min(max(ref_body_h, ref_h * 0.5), ref_h * 1.2)
+        else:
+            ref_body_h = ref_h
+
+        if subject_box and len(subject_box) == 4:
+            sx1, sy1, sx2, sy2 = subject_box
+        else:
+            sx1, sy1, sx2, sy2 = 0, 0, char_w, char_h
+        subject_w = max(sx2 - sx1, 1)
+
+        # 主体底边离图像下沿足够远，说明脚部已完整，无需扩图
+        bottom_margin = max(2, int(char_h * 0.02))
+        if sy2 < char_h - bottom_margin:
+            return pads
+
+        # 按参考人物的宽高比推算角色完整身体应有的高度
+        expected_h = subject_w * ref_body_h / ref_w
+        missing = sy1 + expected_h - sy2
+        max_pad = int(char_h * self.max_extension_ratio)
+        pads["bottom"] = int(min(max(missing, 0), max_pad))
+        return pads
+
+    def extend(self, img: np.ndarray, pads: Dict[str, int]) -> np.ndarray:
+        """
+        按给定边距扩展图像，扩展区域用边缘复制填充，可选在下采样的修复带上做 cv2.inpaint 平滑
+        """
+        top, bottom = pads.get("top", 0), pads.get("bottom", 0)
+        left, right = pads.get("left", 0), pads.get("right", 0)
+        if not (top or bottom or left or right):
+            return img
+
+        extended = cv2.copyMakeBorder(img, top, bottom, left, right, cv2.BORDER_REPLICATE)
+        if self.fill_method != "inpaint":
+            return extended
+
+        h, w = extended.shape[:2]
+        if bottom:
+            self._inpaint_band(extended, h - bottom - SEAM_CONTEXT, h, 0, w, rows=True, pad=bottom)
+        if top:
+            self._inpaint_band(extended, 0, top + SEAM_CONTEXT, 0, w, rows=True, pad=-top)
+        if right:
+            self._inpaint_band(extended, 0, h, w - right - SEAM_CONTEXT, w, rows=False, pad=right)
+        if left:
+            self._inpaint_band(extended, 0, h, 0, left + SEAM_CONTEXT, rows=False, pad=-left)
+        return extended
+
+    def _inpaint_band(self, canvas: np.ndarray, y1: int, y2: int, x1: int, x2: int,
+                      rows: bool, pad: int) -> None:
+        """
+        对扩展带（含少量接缝上下文）下采样后修复，再放大写回扩展区域，原图像素不受影响
+        """
+        y1, x1 = max(0, y1), max(0, x1)
+        band = canvas[y1:y2, x1:x2]
+        band_h, band_w = band.shape[:2]
+
+        mask = np.zeros((band_h, band_w), dtype=np.uint8)
+        if rows:
+            if pad > 0:
+                mask[band_h - pad:, :] = 255
+            else:
+                mask[:-pad, :] = 255
+        else:
+            if pad > 0:
+                mask[:, band_w - pad:] = 255
+            else:
+                mask[:, :-pad] = 255
+
+        scale = min(1.0, INPAINT_BAND_MAX_SIDE / max(band_h, band_w))
+        small_w, small_h = max(1, int(band_w * scale)), max(1, int(band_h * scale))
+        small = cv2.resize(band, (small_w, small_h), interpolation=cv2.INTER_AREA)
+        small_mask = cv2.resize(mask, (small_w, small_h), interpolation=cv2.INTER_NEAREST)
+
+        repaired = cv2.inpaint(small, small_mask, 3, cv2.INPAINT_TELEA)
+        repaired = cv2.resize(repaired, (band_w, band_h), interpolation=cv2.INTER_LINEAR)
+
+        region = mask > 0
+        band[region] = repaired[region]
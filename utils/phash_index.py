@@ -0,0 +1,114 @@
+import copy
+import cv2
+import numpy as np
+import os
+import threading
+from typing import Dict, Any, Optional, Tuple
+
+# 宽高比相差超过该比例时不视为同一构图（避免把大幅裁切的图套用缓存坐标）
+ASPECT_TOLERANCE = 0.1
+
+def perceptual_hash(img: np.ndarray) -> int:
+    """
+    计算64位pHash：灰度图缩放到32x32后做DCT，取左上8x8低频系数与其中位数比较
+    对重新编码、缩放和轻微裁切不敏感
+    """
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(img, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low_freq = cv2.dct(small)[:8, :8].flatten()
+    # 直流分量不参与中位数计算
+    bits = low_freq > np.median(low_freq[1:])
+    return int(np.packbits(bits).view(">u8")[0])
+
+def rescale_analysis(result: Dict[str, Any], src_size: Tuple[int, int],
+                     dst_size: Tuple[int, int]) -> Dict[str, Any]:
+    """
+    把分析结果中的像素坐标（body_box、keypoints）从原图尺寸换算到新图尺寸
+    perspective 中的 horizon_y 是相对比例，无需换算
+    """
+    src_w, src_h = src_size
+    dst_w, dst_h = dst_size
+    sx, sy = dst_w / src_w, dst_h / src_h
+
+    rescaled = copy.deepcopy(result)
+    body_box = rescaled.get("body_box")
+    if isinstance(body_box, list) and len(body_box) == 4:
+        rescaled["body_box"] = [
+            int(round(body_box[0] * sx)), int(round(body_box[1] * sy)),
+            int(round(body_box[2] * sx)), int(round(body_box[3] * sy)),
+        ]
+    for name, point in rescaled.get("keypoints", {}).items():
+        if isinstance(point, list) and len(point) == 2:
+            rescaled["keypoints"][name] = [int(round(point[0] * sx)), int(round(point[1] * sy))]
+    return rescaled
+
+class PerceptualHashIndex:
+    """
+    参考图感知哈希索引
+
+    保存已分析参考图的pHash、尺寸和分析结果，查询时对所有条目做向量化汉明距离计算，
+    距离不超过阈值即视为近似重复，返回换算到新尺寸的分析结果。条目数有上限，按先进先出淘汰。
+    """
+
+    def __init__(self, max_distance: int = 6, max_entries: int = 2048):
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self._hashes = np.zeros(0, dtype=np.uint64)
+        self._entries = []  # [(width, height, analysis_result)]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, image_hash: int, width: int, height: int) -> Optional[Dict[str, Any]]:
+        """
+        查找近似重复的参考图，命中时返回换算到 (width, height) 的分析结果
+        """
+        with self._lock:
+            if len(self._hashes) == 0:
+                self.misses += 1
+                return None
+
+            xor = self._hashes ^ np.uint64(image_hash)
+            distances = np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+            aspect = width / height
+            for idx in np.argsort(distances, kind="stable"):
+                if distances[idx] > self.max_distance:
+                    break
+                src_w, src_h, result = self._entries[idx]
+                if abs(src_w / src_h - aspect) <= ASPECT_TOLERANCE * aspect:
+                    self.hits += 1
+                    return rescale_analysis(result, (src_w, src_h), (width, height))
+
+            self.misses += 1
+            return None
+
+    def add(self, image_hash: int, width: int, height: int, result: Dict[str, Any]) -> None:
+        with self._lock:
+            self._hashes = np.append(self._hashes, np.uint64(image_hash))
+            self._entries.append((width, height, copy.deepcopy(result)))
+            if len(self._entries) > self.max_entries:
+                overflow = len(self._entries) - self.max_entries
+                self._hashes = self._hashes[overflow:]
+                self._entries = self._entries[overflow:]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+# 进程级共享索引
+_shared_index: Optional[PerceptualHashIndex] = None
+_shared_index_lock = threading.Lock()
+
+def get_reference_index() -> PerceptualHashIndex:
+    """获取进程级共享的参考图索引（阈值与容量由 REFERENCE_INDEX_* 配置）"""
+    global _shared_index
+    if _shared_index is None:
+        with _shared_index_lock:
+            if _shared_index is None:
+                _shared_index = PerceptualHashIndex(
+                    max_distance=int(os.getenv("REFERENCE_INDEX_MAX_DISTANCE", 6)),
+                    max_entries=int(os.getenv("REFERENCE_INDEX_MAX_ENTRIES", 2048)),
+                )
+    return _shared_index
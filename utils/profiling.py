@@ -0,0 +1,126 @@
+import cProfile
+import functools
+import heapq
+import io
+import os
+import pstats
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 当前请求的阶段耗时记录，通过 contextvars 传递到线程池中的流水线
+_current_trace: ContextVar[Optional["RequestTrace"]] = ContextVar("current_trace", default=None)
+
+class RequestTrace:
+    """
+    单个请求的阶段耗时记录
+    """
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.total_seconds: Optional[float] = None
+        self.stages: List[Tuple[str, float]] = []
+        self.profile_path: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.stages.append((name, seconds))
+
+    def finish(self) -> None:
+        self.total_seconds = time.perf_counter() - self._started
+
+    def to_dict(self) -> Dict[str, Any]:
+        # 同名阶段（如每轮重试的生图）汇总次数与总耗时
+        summary: Dict[str, Dict[str, Any]] = {}
+        for name, seconds in self.stages:
+            item = summary.setdefault(name, {"calls": 0, "seconds": 0.0})
+            item["calls"] += 1
+            item["seconds"] += seconds
+        for item in summary.values():
+            item["seconds"] = round(item["seconds"], 4)
+
+        return {
+            "job_id": self.job_id,
+            "started_at": self.started_at,
+            "total_seconds": round(self.total_seconds or 0.0, 4),
+            "stages": summary,
+            "profile_path": self.profile_path,
+        }
+
+def start_trace(trace: RequestTrace):
+    """在当前上下文中开始记录，返回用于 end_trace 的 token"""
+    return _current_trace.set(trace)
+
+def end_trace(token) -> None:
+    _current_trace.reset(token)
+
+def traced(stage_name: str) -> Callable:
+    """
+    阶段计时装饰器：当前上下文中没有请求记录时直接调用，几乎没有额外开销
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            trace = _current_trace.get()
+            if trace is None:
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                trace.add_stage(stage_name, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+def run_profiled(job_id: str, func: Callable, *args, **kwargs) -> Tuple[Any, str]:
+    """
+    在确定性分析器（cProfile）下执行 func，分析结果保存到 PROFILE_DIR/<job_id>.prof，
+    返回 (func的返回值, 分析文件路径)。需在执行流水线的线程内调用
+    """
+    profile_dir = os.getenv("PROFILE_DIR", "output/profiles")
+    os.makedirs(profile_dir, exist_ok=True)
+    profile_path = os.path.join(profile_dir, f"{job_id}.prof")
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        profiler.disable()
+        profiler.dump_stats(profile_path)
+        # 同时输出一份按累计耗时排序的文本摘要，便于直接查看
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(40)
+        with open(f"{profile_path}.txt", "w", encoding="utf-8") as f:
+            f.write(summary.getvalue())
+    return result, profile_path
+
+class SlowRequestLog:
+    """
+    保留总耗时最长的N个请求及其阶段明细（最小堆，O(log N) 插入）
+    """
+
+    def __init__(self, capacity: int = 20):
+        self.capacity = capacity
+        self._heap: List[Tuple[float, int, Dict[str, Any]]] = []
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def record(self, trace: RequestTrace) -> None:
+        if trace.total_seconds is None:
+            trace.finish()
+        entry = (trace.total_seconds, self._counter, trace.to_dict())
+        with self._lock:
+            self._counter += 1
+            if len(self._heap) < self.capacity:
+                heapq.heappush(self._heap, entry)
+            elif entry[0] > self._heap[0][0]:
+                heapq.heapreplace(self._heap, entry)
+
+    def slowest(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [item[2] for item in sorted(self._heap, key=lambda e: e[0], reverse=True)]
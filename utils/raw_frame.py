@@ -0,0 +1,57 @@
+import numpy as np
+import os
+import struct
+
+# 内部中间帧格式：32字节头 + 未压缩的 HWC uint8 像素数据
+# 头部布局：8字节魔数 | height(uint32) | width(uint32) | channels(uint32) | 12字节保留
+RAW_FRAME_MAGIC = b"RSFRAME1"
+RAW_FRAME_EXT = ".rsf"
+RAW_FRAME_HEADER_SIZE = 32
+_HEADER_STRUCT = struct.Struct("<8sIII12x")
+
+def is_raw_frame(image_path: str) -> bool:
+    """判断文件是否为内部原始帧格式"""
+    if os.path.splitext(image_path)[1].lower() != RAW_FRAME_EXT:
+        return False
+    try:
+        with open(image_path, "rb") as f:
+            return f.read(len(RAW_FRAME_MAGIC)) == RAW_FRAME_MAGIC
+    except OSError:
+        return False
+
+def write_raw_frame(output_path: str, img: np.ndarray) -> str:
+    """
+    将图像以原始帧格式写入磁盘，无任何压缩开销
+    """
+    if img.dtype != np.uint8:
+        raise ValueError(f"原始帧仅支持uint8图像，当前为: {img.dtype}")
+
+    if img.ndim == 2:
+        img = img[:, :, np.newaxis]
+    h, w, c = img.shape
+
+    with open(output_path, "wb") as f:
+        f.write(_HEADER_STRUCT.pack(RAW_FRAME_MAGIC, h, w, c))
+        f.write(memoryview(np.ascontiguousarray(img)).cast("B"))
+    return output_path
+
+def read_raw_frame(image_path: str) -> np.ndarray:
+    """
+    以只读 np.memmap 方式打开原始帧，不发生解码和拷贝，
+    多个阶段或多个worker进程打开同一文件时共享页缓存
+    """
+    with open(image_path, "rb") as f:
+        header = f.read(RAW_FRAME_HEADER_SIZE)
+
+    if len(header) != RAW_FRAME_HEADER_SIZE:
+        raise ValueError(f"原始帧头部不完整: {image_path}")
+
+    magic, h, w, c = _HEADER_STRUCT.unpack(header)
+    if magic != RAW_FRAME_MAGIC:
+        raise ValueError(f"不是有效的原始帧文件: {image_path}")
+
+    frame = np.memmap(image_path, dtype=np.uint8, mode="r",
+                      offset=RAW_FRAME_HEADER_SIZE, shape=(h, w, c))
+    if c == 1:
+        return frame[:, :, 0]
+    return frame
@@ -0,0 +1,138 @@
+import asyncio
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from .deadline import (
+    Deadline, JobDeadline, DEADLINE_ERRORS, activate_deadline, reset_deadline, current_deadline
+)
+
+# 等待者检查自身是否已取消的间隔（秒）
+WAIT_POLL_SECONDS = 0.5
+# 共享执行因超时/取消失败后，仍有时间的等待者最多重新发起的次数
+MAX_DEADLINE_RETRIES = 2
+
+class SingleFlight:
+    """
+    相同请求合并
+
+    同一个键同时只执行一次：第一个调用者执行实际工作，执行期间到达的相同调用
+    挂到同一个 Future 上共享结果（或异常），执行结束后键即释放，不做结果缓存。
+    同步调用（do）和异步调用（do_async）共用同一张在途表。
+
+    同步调用的共享执行按所有等待者中最晚的截止时间运行，等待者各自按自己的剩余时间等待，
+    不会收到其他请求的超时或取消错误。
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._calls: Dict[Hashable, Future] = {}
+        self._deadlines: Dict[Hashable, JobDeadline] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def _join(self, key: Hashable) -> Tuple[Future, bool]:
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            self.executed += 1
+            return future, True
+
+    def _join_with_deadline(self, key: Hashable, deadline: Optional[Deadline]) -> Tuple[Future, bool, JobDeadline]:
+        """加入在途执行，同时把自己的截止时间登记到该执行的共享截止时间中"""
+        with self._lock:
+            future, leader = self._join(key)
+            job_deadline = self._deadlines.setdefault(key, JobDeadline())
+            job_deadline.join(deadline)
+            return future, leader, job_deadline
+
+    def _finish(self, key: Hashable) -> None:
+        with self._lock:
+            self._calls.pop(key, None)
+            self._deadlines.pop(key, None)
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        在当前线程中执行 fn；已有相同键在执行时按自己的截止时间等待其结果。
+        共享执行因时间预算或取消而失败、自己仍有剩余时间时，重新发起执行
+        """
+        deadline = current_deadline()
+        for attempt in range(MAX_DEADLINE_RETRIES + 1):
+            future, leader, job_deadline = self._join_with_deadline(key, deadline)
+            if leader:
+                return self._run_leader(key, future, job_deadline, deadline, fn, *args, **kwargs)
+
+            try:
+                return self._wait(future, deadline)
+            except DEADLINE_ERRORS:
+                own_budget_left = deadline is None or not (deadline.cancelled or deadline.expired())
+                if not own_budget_left or attempt == MAX_DEADLINE_RETRIES:
+                    raise
+            finally:
+                job_deadline.leave(deadline)
+
+    def _run_leader(self, key: Hashable, future: Future, job_deadline: JobDeadline,
+                    deadline: Optional[Deadline], fn: Callable[..., Any], *args, **kwargs) -> Any:
+        # 执行期间的上游超时与取消按所有等待者中最晚的截止时间计算
+        token = activate_deadline(job_deadline)
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            reset_deadline(token)
+            job_deadline.leave(deadline)
+            self._finish(key)
+        future.set_result(result)
+        return result
+
+    def _wait(self, future: Future, deadline: Optional[Deadline]) -> Any:
+        """按自己的剩余时间等待共享结果，期间检查是否已取消"""
+        if deadline is None:
+            return future.result()
+        while True:
+            deadline.check("等待合并的请求")
+            try:
+                return future.result(timeout=min(max(deadline.remaining(), 0.01), WAIT_POLL_SECONDS))
+            except FutureTimeout:
+                continue
+
+    async def do_async(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        在线程池中执行阻塞的 fn，不阻塞事件循环；
+        调用方被取消时后台工作继续完成，其他等待者仍能拿到结果
+        """
+        shared, _ = self.start_async(key, fn, *args, **kwargs)
+        return await asyncio.shield(shared)
+
+    def start_async(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Tuple[asyncio.Future, bool]:
+        """
+        加入（或发起）在线程池中的执行，立即返回 (结果Future, 是否为发起者)，
+        调用方可自行决定等待多久；放弃等待不会影响执行本身与其他等待者
+        """
+        future, leader = self._join(key)
+        if leader:
+            task = asyncio.ensure_future(asyncio.to_thread(fn, *args, **kwargs))
+            task.add_done_callback(lambda t: self._resolve(key, future, t))
+        shared = asyncio.wrap_future(future)
+        # 放弃等待的调用方不会取结果，这里取一次异常，避免“异常未被获取”的告警
+        shared.add_done_callback(lambda f: f.cancelled() or f.exception())
+        return shared, leader
+
+    def _resolve(self, key: Hashable, future: Future, task: "asyncio.Task") -> None:
+        self._finish(key)
+        if task.cancelled():
+            future.set_exception(asyncio.CancelledError())
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+        else:
+            future.set_result(task.result())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"in_flight": len(self._calls), "executed": self.executed, "coalesced": self.coalesced}
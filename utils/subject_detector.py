@@ -0,0 +1,240 @@
+import cv2
+import numpy as np
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Tuple
+
+from .image_cache import get_image_cache, path_under
+
+# 检测在下采样副本上进行，最长边不超过该值
+DETECT_MAX_SIDE = 256
+# 边框采样宽度（下采样后的像素），用于估计背景颜色
+BORDER_WIDTH = 4
+# 最多缓存的检测结果条数
+MAX_CACHED_RESULTS = 512
+
+class SubjectDetector:
+    """
+    角色主体定位
+
+    在下采样副本上用背景颜色模型（边框像素的中位颜色）分割前景，分割失败时退回 GrabCut，
+    得到角色主体的边界框和按人体比例估计的关键点。结果按 (路径, mtime, 大小) 缓存，
+    同一张角色图只检测一次，后续裁切、扩图都以此为准。
+    """
+
+    def __init__(self):
+        self.image_cache = get_image_cache()
+        self._results: "OrderedDict[Tuple[str, int, int], Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _make_key(self, image_path: str) -> Optional[Tuple[str, int, int]]:
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return None
+        return (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size)
+
+    def detect(self, image_path: str) -> Dict[str, Any]:
+        """
+        定位角色主体
+
+        Returns:
+            {"box": [x1, y1, x2, y2], "keypoints": {...}, "confidence": float, "method": str}
+        """
+        key = self._make_key(image_path)
+        if key is not None:
+            with self._lock:
+                cached = self._results.get(key)
+                if cached is not None:
+                    self._results.move_to_end(key)
+                    return cached
+
+        img = self.image_cache.imread(image_path)
+        if img is None:
+            raise Exception(f"无法读取图像文件: {image_path}")
+
+        result = self._detect_array(img)
+        if key is not None:
+            self._store(key, result)
+        return result
+
+    def remember(self, image_path: str, result: Dict[str, Any]) -> None:
+        """
+        直接登记某张图的检测结果（例如裁切后换算坐标的结果），避免再次检测
+        """
+        key = self._make_key(image_path)
+        if key is not None:
+            self._store(key, result)
+
+    def invalidate_directory(self, directory: str) -> None:
+        """移除某个目录下所有文件的检测结果"""
+        with self._lock:
+            for k in [k for k in self._results if path_under(k[0], directory)]:
+                del self._results[k]
+
+    def _store(self, key: Tuple[str, int, int], result: Dict[str, Any]) -> None:
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+            while len(self._results) > MAX_CACHED_RESULTS:
+                self._results.popitem(last=False)
+
+    def _detect_array(self, img: np.ndarray) -> Dict[str, Any]:
+        h, w = img.shape[:2]
+        if img.ndim == 2:
+            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+
+        scale = min(1.0, DETECT_MAX_SIDE / max(h, w))
+        small = cv2.resize(img, (max(1, int(w * scale)), max(1, int(h * scale))),
+                           interpolation=cv2.INTER_AREA)
+
+        mask = self._background_model_mask(small)
+        method = "background_model"
+        fg_ratio = np.count_nonzero(mask) / mask.size
+        if fg_ratio < 0.005 or fg_ratio > 0.95:
+            # 背景不是纯色（或主体占满画面），退回 GrabCut
+            mask = self._grabcut_mask(small)
+            method = "grabcut"
+            fg_ratio = np.count_nonzero(mask) / mask.size
+
+        if fg_ratio < 0.005:
+            # 定位失败，视整张图为主体
+            box = [0, 0, w, h]
+            return {
+                "box": box,
+                "keypoints": self._estimate_keypoints(box, None, 1.0),
+                "confidence": 0.0,
+                "method": "fallback",
+            }
+
+        ys, xs = np.nonzero(mask)
+        sx1, sy1, sx2, sy2 = xs.min(), ys.min(), xs.max() + 1, ys.max() + 1
+        if method == "grabcut":
+            # GrabCut 不会把初始矩形外的像素标为前景：前景碰到矩形边时，主体实际延伸到了画面边缘
+            sh, sw = mask.shape[:2]
+            mx, my = self._grabcut_margins(sw, sh)
+            sx1 = 0 if sx1 <= mx else sx1
+            sy1 = 0 if sy1 <= my else sy1
+            sx2 = sw if sx2 >= sw - mx else sx2
+            sy2 = sh if sy2 >= sh - my else sy2
+        box = [
+            int(sx1 / scale), int(sy1 / scale),
+            min(w, int(np.ceil(sx2 / scale))), min(h, int(np.ceil(sy2 / scale))),
+        ]
+
+        # 前景在边界框内越紧凑，置信度越高
+        box_area = (sx2 - sx1) * (sy2 - sy1)
+        fill_ratio = np.count_nonzero(mask[sy1:sy2, sx1:sx2]) / max(box_area, 1)
+        confidence = float(min(1.0, 0.5 + fill_ratio)) if method == "background_model" else float(min(0.8, fill_ratio))
+
+        return {
+            "box": box,
+            "keypoints": self._estimate_keypoints(box, mask, scale),
+            "confidence": round(confidence, 3),
+            "method": method,
+        }
+
+    def _background_model_mask(self, small: np.ndarray) -> np.ndarray:
+        """
+        以边框像素的中位颜色为背景模型，与其距离超过阈值的像素视为前景
+
+        主体越出画面时会占据一部分边框：背景颜色取各边中位颜色的中位数，
+        噪声水平取距离的中位数（下半分位），都不受越界主体的影响
+        """
+        b = BORDER_WIDTH
+        sides = [
+            small[:b].reshape(-1, 3), small[-b:].reshape(-1, 3),
+            small[:, :b].reshape(-1, 3), small[:, -b:].reshape(-1, 3),
+        ]
+        side_colors = np.array([np.median(side, axis=0) for side in sides], dtype=np.float32)
+        bg_color = np.median(side_colors, axis=0)
+        border = np.concatenate(sides).astype(np.float32)
+        border_dist = np.linalg.norm(border - bg_color, axis=1)
+        # 阈值随背景噪声自适应，下限避免JPEG噪点被当成前景
+        threshold = max(30.0, float(np.percentile(border_dist, 50)) * 4.0)
+
+        dist = np.linalg.norm(small.astype(np.float32) - bg_color, axis=2)
+        mask = (dist > threshold).astype(np.uint8) * 255
+        return self._clean_mask(mask)
+
+    @staticmethod
+    def _grabcut_margins(w: int, h: int) -> Tuple[int, int]:
+        """GrabCut 初始矩形在四边各内缩的像素数"""
+        return max(1, w // 20), max(1, h // 20)
+
+    def _grabcut_mask(self, small: np.ndarray) -> np.ndarray:
+        h, w = small.shape[:2]
+        if h < 8 or w < 8:
+            return np.zeros((h, w), dtype=np.uint8)
+        mx, my = self._grabcut_margins(w, h)
+        rect = (mx, my, w - 2 * mx, h - 2 * my)
+        gc_mask = np.zeros((h, w), dtype=np.uint8)
+        bgd_model = np.zeros((1, 65), dtype=np.float64)
+        fgd_model = np.zeros((1, 65), dtype=np.float64)
+        try:
+            cv2.grabCut(np.ascontiguousarray(small), gc_mask, rect, bgd_model, fgd_model, 2, cv2.GC_INIT_WITH_RECT)
+        except cv2.error:
+            return np.zeros((h, w), dtype=np.uint8)
+        mask = np.where((gc_mask == cv2.GC_FGD) | (gc_mask == cv2.GC_PR_FGD), 255, 0).astype(np.uint8)
+        return self._clean_mask(mask)
+
+    def _clean_mask(self, mask: np.ndarray) -> np.ndarray:
+        """
+        形态学去噪，并只保留面积足够大的连通域
+        """
+        kernel = np.ones((3, 3), np.uint8)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=2)
+
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        if count <= 1:
+            return mask
+        areas = stats[1:, cv2.CC_STAT_AREA]
+        min_area = max(4, int(areas.max() * 0.05))
+        keep = np.zeros(count, dtype=bool)
+        keep[1:] = areas >= min_area
+        return np.where(keep[labels], 255, 0).astype(np.uint8)
+
+    def _estimate_keypoints(self, box: List[int], mask: Optional[np.ndarray],
+                            scale: float) -> Dict[str, Optional[List[int]]]:
+        """
+        按常见人体比例由主体边界框估计关键点；竖长的主体按全身处理，否则按半身处理
+        """
+        x1, y1, x2, y2 = box
+        bw, bh = x2 - x1, y2 - y1
+        cx = (x1 + x2) // 2
+
+        full_body = bh > bw * 2.2
+        nose_y = y1 + int(bh * (0.07 if full_body else 0.18))
+
+        # 用头部区域前景的水平质心修正鼻子的 x 坐标
+        if mask is not None:
+            my = int(nose_y * scale)
+            row_band = mask[max(0, my - 2):my + 3, int(x1 * scale):int(x2 * scale)]
+            cols = np.nonzero(row_band)[1]
+            if cols.size:
+                cx = int((int(x1 * scale) + cols.mean()) / scale)
+
+        keypoints = {"nose": [cx, nose_y], "hip": None, "l_ankle": None, "r_ankle": None}
+        if full_body:
+            keypoints["hip"] = [cx, y1 + int(bh * 0.52)]
+            ankle_y = y1 + int(bh * 0.95)
+            keypoints["l_ankle"] = [cx - bw // 6, ankle_y]
+            keypoints["r_ankle"] = [cx + bw // 6, ankle_y]
+        elif bh > bw * 1.2:
+            keypoints["hip"] = [cx, y1 + int(bh * 0.9)]
+        return keypoints
+
+# 进程级共享检测器
+_shared_detector: Optional[SubjectDetector] = None
+_shared_detector_lock = threading.Lock()
+
+def get_subject_detector() -> SubjectDetector:
+    """获取进程级共享的角色主体检测器"""
+    global _shared_detector
+    if _shared_detector is None:
+        with _shared_detector_lock:
+            if _shared_detector is None:
+                _shared_detector = SubjectDetector()
+    return _shared_detector
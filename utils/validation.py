@@ -2,6 +2,8 @@ import cv2
 import numpy as np
 from typing import Dict, Any, Tuple
 from .vlm_client import VLMClient
+from .image_cache import get_image_cache
+from .profiling import traced
 import os
 
 class ValidationResult:
@@ -13,6 +15,7 @@ class ValidationResult:
 class ValidationEngine:
     def __init__(self):
         self.vlm_client = VLMClient()
+        self.image_cache = get_image_cache()
 
     def validate_shot_consistency(self, generated_image_path: str, 
                                 reference_analysis: Dict[str, Any]) -> ValidationResult:
@@ -48,7 +51,8 @@ class ValidationEngine:
             # 简化的特征一致性验证
             # 实际应用中需要使用特征提取模型比较两个图像的特征相似度
             gen_img = cv2.imread(generated_image_path)
-            orig_img = cv2.imread(original_character_path)
+            # 原始角色图在每轮重试中都会被读取，走共享缓存避免重复解码
+            orig_img = self.image_cache.imread(original_character_path)
             
             if gen_img is None or orig_img is None:
                 return ValidationResult(
@@ -111,6 +115,7 @@ class ValidationEngine:
                 feedback=f"透视验证失败: {str(e)}"
             )
 
+    @traced("ValidationEngine.comprehensive_validation")
     def comprehensive_validation(self, generated_image_path: str,
                                reference_analysis: Dict[str, Any],
                                original_character_path: str) -> Dict[str, ValidationResult]:
@@ -1,18 +1,32 @@
 import requests
 import json
 import base64
-from typing import Dict, Any
+import time
+from typing import Dict, Any, Optional
 from dotenv import load_dotenv
 import os
 
+from .image_cache import get_image_cache
+from .phash_index import get_reference_index, perceptual_hash
+from .single_flight import SingleFlight
+from .http_client import get_http_session
+from .profiling import traced
+from .deadline import upstream_timeout
+from .model_cascade import check_analysis_sanity, cascade_settings, get_cascade_stats
+
 # 加载环境变量
 load_dotenv()
 
+# 同一参考图（相同感知哈希与尺寸）的并发分析只向VLM发起一次
+_analysis_flight = SingleFlight()
+
 class VLMClient:
     def __init__(self):
         self.base_url = os.getenv("BASE_URL")
         self.api_key = os.getenv("API_KEY")
         self.vlm_model = os.getenv("VLM_MODEL")
+        # 级联的第一级：小而快的模型，未配置时只使用 VLM_MODEL
+        self.vlm_fast_model = os.getenv("VLM_FAST_MODEL")
         self.headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.api_key}"
@@ -23,6 +37,7 @@ class VLMClient:
         with open(image_path, "rb") as image_file:
             return base64.b64encode(image_file.read()).decode('utf-8')
 
+    @traced("VLMClient.analyze_composition")
     def analyze_composition(self, reference_image_path: str) -> Dict[str, Any]:
         """
         分析构图参考图，提取结构化约束
@@ -33,6 +48,35 @@ class VLMClient:
         Returns:
             包含景别、关键点、透视、位姿等信息的字典
         """
+        # 先查感知哈希索引：重新编码/缩放过的同一参考图直接复用已有分析结果
+        reference_img = get_image_cache().imread(reference_image_path)
+        if reference_img is None:
+            return self._request_composition_analysis(reference_image_path)
+
+        height, width = reference_img.shape[:2]
+        image_hash = perceptual_hash(reference_img)
+        reference_index = get_reference_index()
+        cached_result = reference_index.lookup(image_hash, width, height)
+        if cached_result is not None:
+            return cached_result
+
+        return _analysis_flight.do(
+            (image_hash, width, height), self._analyze_and_index,
+            reference_image_path, image_hash, width, height
+        )
+
+    def _analyze_and_index(self, reference_image_path: str, image_hash: int,
+                           width: int, height: int) -> Dict[str, Any]:
+        result = self._request_composition_analysis(reference_image_path, width, height)
+        if self.validate_analysis_result(result):
+            get_reference_index().add(image_hash, width, height, result)
+        return result
+
+    def _request_composition_analysis(self, reference_image_path: str, width: Optional[int] = None,
+                                      height: Optional[int] = None) -> Dict[str, Any]:
+        """
+        调用VLM分析构图参考图，按模型级联依次尝试
+        """
         # 编码图片
         base64_image = self.encode_image(reference_image_path)
         
@@ -58,7 +102,8 @@ class VLMClient:
     "horizon_y": 0.5, // 地平线位置（相对于图片高度的比例）
     "is_slanted_ground": true // 是否为斜面地面
   }, 
-  "pose_type": "standing / sitting / others" // 位姿判定
+  "pose_type": "standing / sitting / others", // 位姿判定
+  "confidence": 0.9 // 对以上分析结果的整体置信度（0到1）
 }
 
 请确保返回有效的JSON格式，不要添加任何其他解释文本。"""
@@ -73,23 +118,58 @@ class VLMClient:
             }
         ]
         
-        # 发送请求
-        payload = {
-            "model": self.vlm_model,
-            "messages": messages,
-            "temperature": 0.1,
-            "max_tokens": 1024
-        }
-        
-        response = requests.post(self.base_url, headers=self.headers, json=payload)
-        
-        if response.status_code != 200:
-            raise Exception(f"VLM API调用失败: {response.status_code} - {response.text}")
-        
-        # 解析响应
-        result = response.json()
-        content = result.get("choices", [{}])[0].get("message", {}).get("content", "")
-        
+        return self._analyze_with_cascade(messages, width, height)
+
+    def _model_tiers(self):
+        """级联层级：先快速模型，再主模型；两者相同或未配置快速模型时只有一级"""
+        tiers = []
+        if self.vlm_fast_model and self.vlm_fast_model != self.vlm_model:
+            tiers.append(("fast", self.vlm_fast_model))
+        tiers.append(("full", self.vlm_model))
+        return tiers
+
+    def _analyze_with_cascade(self, messages, width: Optional[int], height: Optional[int]) -> Dict[str, Any]:
+        """
+        模型级联：快速模型的结果通过格式、置信度与几何合理性检查时直接采用，
+        否则（或调用失败时）升级到主模型；最后一级的结果按原逻辑返回
+        """
+        stats = get_cascade_stats()
+        settings = cascade_settings()
+        tiers = self._model_tiers()
+
+        for index, (tier, model) in enumerate(tiers):
+            is_last = index == len(tiers) - 1
+            started = time.perf_counter()
+            try:
+                content = self._chat_completion(messages, temperature=0.1, max_tokens=1024, model=model)
+                result = self._parse_analysis_json(content)
+            except Exception:
+                stats.record(tier, time.perf_counter() - started, error=True,
+                             escalation_reason=None if is_last else "error")
+                if is_last:
+                    raise
+                continue
+
+            if is_last:
+                stats.record(tier, time.perf_counter() - started, accepted=True)
+                return result
+
+            reason = self._check_analysis(result, width, height, settings)
+            stats.record(tier, time.perf_counter() - started, accepted=reason is None, escalation_reason=reason)
+            if reason is None:
+                return result
+
+    def _check_analysis(self, result: Dict[str, Any], width: Optional[int], height: Optional[int],
+                        settings: Dict[str, float]) -> Optional[str]:
+        """快速模型结果的检查，通过时返回 None，否则返回升级原因"""
+        if not self.validate_analysis_result(result):
+            return "invalid_format"
+        if width is None or height is None:
+            # 无法得知图像尺寸时不能做几何检查，交给主模型
+            return "unknown_image_size"
+        return check_analysis_sanity(result, width, height, settings["min_confidence"], settings["tolerance"])
+
+    def _parse_analysis_json(self, content: str) -> Dict[str, Any]:
         # 提取JSON部分
         try:
             # 查找JSON部分
@@ -103,6 +183,64 @@ class VLMClient:
         except json.JSONDecodeError:
             raise Exception(f"JSON解析失败: {content}")
 
+    @traced("VLMClient.describe_character")
+    def describe_character(self, character_image_path: str) -> str:
+        """
+        用VLM生成角色的外观描述，作为生图Prompt中的角色身份文本
+        
+        Args:
+            character_image_path: 角色图路径
+            
+        Returns:
+            简洁的英文外观描述
+        """
+        base64_image = self.encode_image(character_image_path)
+        
+        messages = [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": """请用一句简洁的英文描述图中角色的外观身份特征，用于图像生成时保持角色一致：
+包括性别与年龄段、发型与发色、面部特征、服装款式与颜色、显著配饰。
+只描述角色本身，不要描述背景，不要添加任何其他解释文本。"""
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:image/jpeg;base64,{base64_image}"
+                        }
+                    }
+                ]
+            }
+        ]
+        
+        return self._chat_completion(messages, temperature=0.2, max_tokens=256).strip()
+
+    def _chat_completion(self, messages, temperature: float, max_tokens: int,
+                         model: Optional[str] = None) -> str:
+        """
+        发送VLM请求并返回文本内容，model 未指定时使用 VLM_MODEL
+        """
+        payload = {
+            "model": model or self.vlm_model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }
+        
+        # 超时取当前请求剩余的时间预算
+        response = get_http_session().post(self.base_url, headers=self.headers, json=payload,
+                                           timeout=upstream_timeout())
+        
+        if response.status_code != 200:
+            raise Exception(f"VLM API调用失败: {response.status_code} - {response.text}")
+        
+        # 解析响应
+        result = response.json()
+        return result.get("choices", [{}])[0].get("message", {}).get("content", "")
+
     def validate_analysis_result(self, result: Dict[str, Any]) -> bool:
         """
         验证分析结果是否符合要求格式
@@ -118,9 +256,12 @@ class VLMClient:
             return False
         
         # 验证keypoints格式
+        if not isinstance(result["keypoints"], dict):
+            return False
         required_keypoints = ["l_ankle", "r_ankle", "nose", "hip"]
         for kp in required_keypoints:
-            if kp not in result["keypoints"] or len(result["keypoints"][kp]) != 2:
+            if kp not in result["keypoints"] or not isinstance(result["keypoints"][kp], list) \
+                    or len(result["keypoints"][kp]) != 2:
                 return False
         
         # 验证perspective格式
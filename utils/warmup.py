@@ -0,0 +1,99 @@
+import logging
+import threading
+import time
+from typing import Dict, Any
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from .image_cache import get_image_cache
+from .subject_detector import get_subject_detector
+from .phash_index import get_reference_index
+
+# 复用 uvicorn/gunicorn 已配置好的日志输出
+logger = logging.getLogger("uvicorn.error")
+
+_state: Dict[str, Any] = {
+    "ready": False,
+    "boot_started": None,
+    "imports_seconds": None,
+    "warmup_seconds": None,
+    "cold_start_seconds": None,
+    "steps": {},
+}
+_lock = threading.Lock()
+
+def mark_boot_started(started_at: float) -> None:
+    """记录进程开始导入应用的时间点（time.perf_counter），用于计算冷启动耗时"""
+    _state["boot_started"] = started_at
+
+def mark_imports_done() -> None:
+    """记录重量级依赖导入完成"""
+    if _state["boot_started"] is not None:
+        _state["imports_seconds"] = round(time.perf_counter() - _state["boot_started"], 4)
+
+def _timed(name: str, func) -> None:
+    started = time.perf_counter()
+    func()
+    _state["steps"][name] = round(time.perf_counter() - started, 4)
+
+def _warm_opencv() -> None:
+    # 触发OpenCV编解码器与常用算子的首次初始化，避免首个请求承担这部分延迟
+    img = np.full((64, 64, 3), 128, dtype=np.uint8)
+    for ext in (".jpg", ".png"):
+        ok, buffer = cv2.imencode(ext, img)
+        if ok:
+            cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+    small = cv2.resize(img, (32, 32), interpolation=cv2.INTER_AREA)
+    cv2.GaussianBlur(small, (5, 5), 1)
+    mask = np.zeros((32, 32), dtype=np.uint8)
+    mask[24:, :] = 255
+    cv2.inpaint(small, mask, 3, cv2.INPAINT_TELEA)
+    cv2.dct(np.zeros((32, 32), dtype=np.float32))
+
+def _warm_pillow() -> None:
+    Image.new("RGB", (8, 8)).convert("L")
+
+def _warm_shared_state() -> None:
+    # 创建进程级共享组件；预加载模式下在fork前完成，worker直接继承
+    get_image_cache()
+    get_subject_detector()
+    get_reference_index()
+
+def warm_up() -> Dict[str, Any]:
+    """
+    执行启动预热，完成后就绪检查才会返回ready，重复调用不会重复执行
+    """
+    with _lock:
+        if _state["ready"]:
+            return get_readiness()
+
+        started = time.perf_counter()
+        _timed("opencv", _warm_opencv)
+        _timed("pillow", _warm_pillow)
+        _timed("shared_state", _warm_shared_state)
+        _state["warmup_seconds"] = round(time.perf_counter() - started, 4)
+
+        if _state["boot_started"] is not None:
+            _state["cold_start_seconds"] = round(time.perf_counter() - _state["boot_started"], 4)
+        _state["ready"] = True
+
+    logger.info(
+        "预热完成: 导入 %ss, 预热 %ss, 冷启动总计 %ss",
+        _state["imports_seconds"], _state["warmup_seconds"], _state["cold_start_seconds"],
+    )
+    return get_readiness()
+
+def is_ready() -> bool:
+    return _state["ready"]
+
+def get_readiness() -> Dict[str, Any]:
+    """就绪状态与冷启动耗时明细"""
+    return {
+        "ready": _state["ready"],
+        "imports_seconds": _state["imports_seconds"],
+        "warmup_seconds": _state["warmup_seconds"],
+        "cold_start_seconds": _state["cold_start_seconds"],
+        "steps": dict(_state["steps"]),
+    }
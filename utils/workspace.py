@@ -0,0 +1,289 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, Any, List, Optional
+
+from .encoding import get_image_encoder
+from .image_cache import get_image_cache
+from .subject_detector import get_subject_detector
+
+logger = logging.getLogger("uvicorn.error")
+
+# 当前任务的工作区，通过 contextvars 传到流水线线程，写出的文件自动登记
+_current_workspace: ContextVar[Optional["Workspace"]] = ContextVar("current_workspace", default=None)
+
+OWNER_FILE = ".owner"
+WORKSPACE_PREFIX = "job-"
+
+class WorkspaceQuotaExceeded(Exception):
+    """任务写出的文件总量超过工作区配额"""
+
+def _default_root(required_bytes: int) -> str:
+    """
+    优先使用内存文件系统，中间产物的读写不落物理磁盘；
+    /dev/shm 可用空间不足以容纳所有并发任务的配额时（如Docker默认只有64MB）回退到磁盘临时目录
+    """
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        try:
+            free_bytes = shutil.disk_usage("/dev/shm").free
+        except OSError:
+            free_bytes = 0
+        if free_bytes >= required_bytes:
+            return "/dev/shm/role_scene_fusion"
+        logger.warning("/dev/shm 可用空间 %d 字节不足 %d 字节，工作区改用磁盘临时目录", free_bytes, required_bytes)
+    return os.path.join(tempfile.gettempdir(), "role_scene_fusion")
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def track_artifact(file_path: str) -> None:
+    """
+    把任务写出的文件登记到当前工作区（没有工作区时忽略）
+    """
+    workspace = _current_workspace.get()
+    if workspace is not None:
+        workspace.track(file_path)
+
+class Workspace:
+    """
+    单个任务的临时工作区：记录写出的每个文件并按字节配额限制总量
+    """
+
+    def __init__(self, manager: "WorkspaceManager", job_id: str, path: str, quota_bytes: int):
+        self.manager = manager
+        self.job_id = job_id
+        self.path = path
+        self.quota_bytes = quota_bytes
+        self.used_bytes = 0
+        self.artifacts: List[str] = []
+        self._lock = threading.Lock()
+        self._token = None
+
+    def file_path(self, file_name: str) -> str:
+        """工作区内的文件路径，只保留文件名部分，防止上传文件名中的路径穿越"""
+        safe_name = os.path.basename(file_name or "") or "upload"
+        return os.path.join(self.path, safe_name)
+
+    def track(self, file_path: str) -> None:
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            return
+        with self._lock:
+            self.artifacts.append(file_path)
+            self.used_bytes += size
+            over_quota = self.used_bytes > self.quota_bytes
+        if over_quota:
+            raise WorkspaceQuotaExceeded(
+                f"任务 {self.job_id} 的文件总量 {self.used_bytes} 字节超过配额 {self.quota_bytes} 字节"
+            )
+
+    def activate(self) -> None:
+        """设为当前上下文的工作区"""
+        self._token = _current_workspace.set(self)
+
+    def release(self) -> None:
+        """删除工作区目录并丢弃各缓存中该目录下文件的条目；删除失败时记录日志，由后台清理兜底"""
+        if self._token is not None:
+            _current_workspace.reset(self._token)
+            self._token = None
+        try:
+            shutil.rmtree(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("工作区清理失败 %s: %s", self.path, e)
+        # 文件已删除，缓存中的内存映射与检测/编码结果不会再命中，及时释放
+        get_image_cache().invalidate_directory(self.path)
+        get_subject_detector().invalidate_directory(self.path)
+        get_image_encoder().invalidate_directory(self.path)
+        self.manager._forget(self)
+
+def _prune_directory(directory: str, retention: float, max_files: int,
+                     max_bytes: Optional[int] = None) -> int:
+    """
+    按修改时间从旧到新删除目录下的文件：超过保留时长的一律删除，
+    文件数或总字节数超出上限时继续删除最旧的，返回删除的文件数
+    """
+    if not os.path.isdir(directory):
+        return 0
+
+    files = []
+    for dir_path, _, file_names in os.walk(directory):
+        for name in file_names:
+            path = os.path.join(dir_path, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+    files.sort()
+    now = time.time()
+    total_bytes = sum(size for _, size, _ in files)
+    total_files = len(files)
+    removed = 0
+    for mtime, size, path in files:
+        expired = now - mtime > retention
+        over_limit = total_files > max_files or (max_bytes is not None and total_bytes > max_bytes)
+        if not (expired or over_limit):
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total_bytes -= size
+        total_files -= 1
+        removed += 1
+    return removed
+
+class WorkspaceManager:
+    """
+    工作区管理
+
+    在可配置的快速文件系统（默认 /dev/shm）上为每个任务分配独立目录，带字节配额；
+    后台线程定期清理崩溃遗留（所属进程已退出或超时）的工作区，
+    并按保留时长、总字节数和文件数修剪输出目录，按保留时长和文件数修剪角色档案缓存目录，
+    使磁盘占用与inode数量保持有界。
+    """
+
+    def __init__(self):
+        self.quota_bytes = int(os.getenv("WORKSPACE_QUOTA_BYTES", 256 * 1024 * 1024))
+        # 每个worker最多同时运行 ADMISSION_MAX_CONCURRENT 个任务，按全部用满配额估算所需空间
+        max_concurrent = int(os.getenv("ADMISSION_MAX_CONCURRENT", 8))
+        self.root = os.getenv("WORKSPACE_ROOT") or _default_root(self.quota_bytes * max_concurrent)
+        self.max_age = float(os.getenv("WORKSPACE_MAX_AGE_SECONDS", 3600))
+        self.sweep_interval = float(os.getenv("WORKSPACE_SWEEP_INTERVAL", 60))
+        self.output_dir = os.getenv("OUTPUT_DIR", "output")
+        self.output_retention = float(os.getenv("OUTPUT_RETENTION_SECONDS", 24 * 3600))
+        self.output_max_bytes = int(os.getenv("OUTPUT_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+        self.output_max_files = int(os.getenv("OUTPUT_MAX_FILES", 5000))
+        self.profile_cache_dir = os.getenv("CHARACTER_PROFILE_CACHE_DIR", "cache/character_profiles")
+        self.profile_cache_retention = float(os.getenv("CHARACTER_PROFILE_CACHE_RETENTION_SECONDS", 30 * 24 * 3600))
+        self.profile_cache_max_files = int(os.getenv("CHARACTER_PROFILE_CACHE_MAX_FILES", 10000))
+
+        self._active: Dict[str, Workspace] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sweeper: Optional[threading.Thread] = None
+        self._sweeper_pid: Optional[int] = None
+        self._last_sweep: Dict[str, Any] = {}
+
+    def create(self, job_id: str) -> Workspace:
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, f"{WORKSPACE_PREFIX}{job_id}")
+        os.makedirs(path)
+        with open(os.path.join(path, OWNER_FILE), "w", encoding="utf-8") as f:
+            json.dump({"pid": os.getpid(), "created_at": time.time()}, f)
+
+        workspace = Workspace(self, job_id, path, self.quota_bytes)
+        with self._lock:
+            self._active[path] = workspace
+        return workspace
+
+    def _forget(self, workspace: Workspace) -> None:
+        with self._lock:
+            self._active.pop(workspace.path, None)
+
+    def start_sweeper(self) -> None:
+        """启动后台清理线程（每个worker进程一个，需在fork之后调用）"""
+        pid = os.getpid()
+        if self._sweeper is not None and self._sweeper_pid == pid and self._sweeper.is_alive():
+            return
+        self._stop.clear()
+        self._sweeper = threading.Thread(target=self._sweep_loop, name="workspace-sweeper", daemon=True)
+        self._sweeper_pid = pid
+        self._sweeper.start()
+
+    def stop_sweeper(self) -> None:
+        self._stop.set()
+
+    def _sweep_loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.warning("工作区后台清理失败: %s", e)
+            self._stop.wait(self.sweep_interval)
+
+    def sweep(self) -> Dict[str, Any]:
+        """清理一次孤儿工作区并修剪输出目录与角色档案缓存目录，返回清理统计"""
+        removed_workspaces = self._sweep_orphans()
+        removed_outputs = self._prune_outputs()
+        removed_profiles = self._prune_profile_cache()
+        self._last_sweep = {
+            "at": time.time(),
+            "removed_workspaces": removed_workspaces,
+            "removed_outputs": removed_outputs,
+            "removed_profiles": removed_profiles,
+        }
+        return self._last_sweep
+
+    def _sweep_orphans(self) -> int:
+        if not os.path.isdir(self.root):
+            return 0
+        with self._lock:
+            active_paths = set(self._active)
+
+        removed = 0
+        now = time.time()
+        for entry in os.scandir(self.root):
+            if not entry.is_dir() or not entry.name.startswith(WORKSPACE_PREFIX):
+                continue
+            if entry.path in active_paths:
+                continue
+            try:
+                with open(os.path.join(entry.path, OWNER_FILE), "r", encoding="utf-8") as f:
+                    owner = json.load(f)
+                orphaned = not _pid_alive(int(owner["pid"])) or now - float(owner["created_at"]) > self.max_age
+            except (OSError, ValueError, KeyError):
+                # 没有所属信息的目录按修改时间判断
+                orphaned = now - entry.stat().st_mtime > self.max_age
+            if orphaned:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+        return removed
+
+    def _prune_outputs(self) -> int:
+        return _prune_directory(self.output_dir, self.output_retention,
+                                self.output_max_files, self.output_max_bytes)
+
+    def _prune_profile_cache(self) -> int:
+        # 角色档案命中时会刷新修改时间，按修改时间修剪即淘汰最久未用的档案
+        return _prune_directory(self.profile_cache_dir, self.profile_cache_retention,
+                                self.profile_cache_max_files)
+
+    def stats(self) -> Dict[str, Any]:
+        """工作区与输出目录的占用情况"""
+        with self._lock:
+            active = list(self._active.values())
+        return {
+            "root": self.root,
+            "active_workspaces": len(active),
+            "active_bytes": sum(ws.used_bytes for ws in active),
+            "quota_bytes": self.quota_bytes,
+            "last_sweep": self._last_sweep,
+        }
+
+_shared_manager: Optional[WorkspaceManager] = None
+_shared_manager_lock = threading.Lock()
+
+def get_workspace_manager() -> WorkspaceManager:
+    """获取进程级共享的工作区管理器"""
+    global _shared_manager
+    if _shared_manager is None:
+        with _shared_manager_lock:
+            if _shared_manager is None:
+                _shared_manager = WorkspaceManager()
+    return _shared_manager
@@ -1,7 +1,11 @@
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 import axios from 'axios';
+import { DEFAULT_UPLOAD_CONFIG, formatBytes, preprocessImage } from './imagePreprocess';
 import './App.css';
 
+// 使用外部API端点，需要在环境变量中配置
+const API_BASE_URL = process.env.REACT_APP_API_BASE_URL || 'http://localhost:8000';
+
 function App() {
   const [characterImage, setCharacterImage] = useState(null);
   const [referenceImage, setReferenceImage] = useState(null);
@@ -9,6 +13,17 @@ function App() {
   const [result, setResult] = useState(null);
   const [loading, setLoading] = useState(false);
   const [logs, setLogs] = useState([]);
+  const [uploadConfig, setUploadConfig] = useState(DEFAULT_UPLOAD_CONFIG);
+
+  useEffect(() => {
+    // 获取服务端的图片尺寸上限，获取失败时使用默认值
+    axios.get(`${API_BASE_URL}/config`)
+      .then(response => setUploadConfig({ ...DEFAULT_UPLOAD_CONFIG, ...response.data }))
+      .catch(error => {
+        console.warn('获取服务端配置失败，使用默认上传参数:', error);
+        addLog(`获取服务端配置失败，按默认最长边 ${DEFAULT_UPLOAD_CONFIG.max_image_dimension}px 预处理: ${error.message}`);
+      });
+  }, []);
 
   const addLog = (message) => {
     setLogs(prev => [...prev, { id: Date.now(), message }]);
@@ -40,21 +55,28 @@ function App() {
     addLog('开始处理图像...');
     
     try {
-      // 使用外部API端点，需要在环境变量中配置
-      const API_BASE_URL = process.env.REACT_APP_API_BASE_URL || 'http://localhost:8000';
-      
+      // 上传前在浏览器内缩放到服务端的最长边上限并重新编码
+      const [characterUpload, referenceUpload] = await Promise.all([
+        preprocessImage(characterImage, uploadConfig),
+        preprocessImage(referenceImage, uploadConfig),
+      ]);
+      addLog(`图像预处理完成：角色图 ${formatBytes(characterImage.size)} → ${formatBytes(characterUpload.size)}，`
+        + `参考图 ${formatBytes(referenceImage.size)} → ${formatBytes(referenceUpload.size)}`);
+
       const formData = new FormData();
-      formData.append('character_image', characterImage);
-      formData.append('reference_image', referenceImage);
+      formData.append('character_image', characterUpload);
+      formData.append('reference_image', referenceUpload);
       if (prompt) {
         formData.append('prompt', prompt);
       }
 
       addLog('正在上传图像到处理服务...');
       
-      const response = await axios.post(`${API_BASE_URL}/api/process`, formData, {
+      const response = await axios.post(`${API_BASE_URL}/process`, formData, {
         headers: {
           'Content-Type': 'multipart/form-data',
+          // 服务端时间预算略短于请求超时，超时前返回目前最好的结果
+          'X-Request-Timeout': '55',
         },
         timeout: 60000, // 60秒超时
       });